@@ -1,2 +1,4 @@
 from chess import pregame
+from chess import uci
+from chess import perft
 from chess.search import play_computer_game, play_against_computer
@@ -9,8 +9,93 @@ from chess.evaluate import Evaluator # for visibility/readibility
 from settings import PIECE_REPRESENTATION
 import chess.pregame
 
+# Zobrist table layout (see chess/pregame/board.py): piece keys indexed by
+# (color*6 + piece type)*64 + square, then a key for each castling right,
+# a key for each en passant file and the side to move key
+CASTLING_HASH_INDEX = 768
+EN_PASSANT_HASH_INDEX = 772
+SIDE_TO_MOVE_HASH_INDEX = 780
+
+# castling rights are bits: white kingside, white queenside, black
+# kingside, black queenside (KQkq in FEN)
+CASTLING_RIGHTS = 'KQkq'
+ALL_CASTLING_RIGHTS = 15
+
+# king and rook home squares of each castling right
+CASTLING_SQUARES = ((60, 63), (60, 56), (4, 7), (4, 0))
+
+# rights kept by a move from or to each square. Moving the king or a rook
+# from its home square, or capturing a rook there, loses its rights.
+CASTLING_RIGHTS_KEPT = [sum(1 << right for right,squares in enumerate(CASTLING_SQUARES)
+                            if square not in squares)
+                        for square in range(64)]
+
+# Squares are indexed from a8 (0) to h1 (63). The bitboard of square s has
+# bit 63-s set, so the first square of a bitboard is its highest bit.
+SQUARE_BITBOARDS = [1 << (63-square) for square in range(64)]
+FULL_BOARD = (1 << 64) - 1
+
 class InvalidPieceOperation(Exception): pass
 class PieceNotFoundException(Exception): pass
+class InvalidFenException(Exception): pass
+
+def get_square(bitboard):
+  """Bitscan forward: index of the bitboard's first square"""
+  return 64 - bitboard.bit_length()
+
+def get_last_square(bitboard):
+  """Bitscan reverse: index of the bitboard's last square"""
+  return 64 - (bitboard & -bitboard).bit_length()
+
+def get_squares(bitboard):
+  """Indices of the bitboard's squares, last square first"""
+  while bitboard:
+    bit = bitboard & -bitboard
+    yield 64 - bit.bit_length()
+    bitboard ^= bit
+
+class AttackTables:
+  """Attack Lookup
+
+  Pawn, Knight, and King attacks are precomputed move bitboards (from
+  pregame, indexed by square). Sliding piece attacks depend on the
+  occupancy and are looked up with magic bitboards.
+  """
+
+  def __init__(self):
+    self.movesets = chess.pregame.load_move_sets()
+    self.bishopMagic,self.rookMagic = chess.pregame.load_magic()
+
+  def find_piece_attacks(self, square, pieceType, color, occupied):
+    """Attack bitboard of a single piece, given its square index"""
+    #PAWN: retrieve precomputed attack set (with color)
+    if pieceType == 0:
+      return self.movesets[0][color][square][1]
+
+    # KING AND KNIGHT: retrieve precomputed attack set
+    elif pieceType == 5 or pieceType == 1:
+      return self.movesets[pieceType][square]
+
+    # ROOK/BISHOP: rank + file moves or diagonal + antidiagonal moves
+    elif pieceType == 2 or pieceType == 3:
+      return self.search_magic_cache(square, pieceType, occupied)
+
+    # QUEEN: rank + file + diagonal + antidiagonal moves
+    return self.search_magic_cache(square, 2, occupied) \
+         | self.search_magic_cache(square, 3, occupied)
+
+  def search_magic_cache(self, square, pieceType, occupied):
+    """Fancy Magic Bitboards
+
+    Attacks of a bishop or rook on the square (an index, not a bitboard).
+    The magic key of the blockers indexes the square's part of a flat
+    attack list. The multiplication is cut to 64 bits like it would
+    overflow in C.
+    """
+    magic = self.bishopMagic if pieceType == 2 else self.rookMagic
+    blockers = occupied & magic.masks[square]
+    magicKey = (blockers * magic.magics[square] & FULL_BOARD) >> magic.shifts[square]
+    return magic.attacks[magic.offsets[square] + magicKey]
 
 class PieceSet(list):
   """Piece List Representation
@@ -18,7 +103,9 @@ class PieceSet(list):
   Includes functionality for piece iteration, update, insert, and remove.
   Pieces will always be stored in the same index for any given board state.
   When a piece is captured, its index will store as an empty bitboard. This
-  allows for fast piece type lookup and iteration.
+  allows for fast piece type lookup and iteration. The mailbox maps each
+  square to the index of the piece on it (or None), so pieces are found by
+  square without scanning the set.
   """
 
   def __init__(self, *args):
@@ -31,7 +118,13 @@ class PieceSet(list):
      self.colorLookup,
      self.colorRanges) = chess.pregame.load_piece_index_values()
 
-    self.colorCounts = [end-start for start,end in self.colorRanges]
+    # empty slots are pieces missing from the position
+    self.colorCounts = [len(list(filter(None, self[start:end])))
+                        for start,end in self.colorRanges]
+
+    self.mailbox = [None]*64
+    for index in range(self.numPieces):
+      if self[index] != 0: self.mailbox[get_square(self[index])] = index
 
   def __iter__(self):
     """Iterates each piece's bitboard, color, and type.
@@ -45,42 +138,47 @@ class PieceSet(list):
       pieceColor = self.colorLookup[index]
       yield piece, pieceType, pieceColor
 
-  def update(self, p0, p1, color):
-    """Updates a piece"""
-    start,end = self.colorRanges[color]
-    for index in range(start,end):
-      piece = self[index]
-      if piece == p0:
-        self[index] = p1
-        return self.typeLookup[index]
-    raise InvalidPieceOperation(f'cannot update piece')
-
-  def insert(self, piece, pieceType, color):
-    """Inserts a piece by finding an empty slot"""
+  def __reduce__(self):
+    """Pickles piece bitboards, not the tuples yielded by iteration"""
+    return PieceSet, (self[:],), self.__dict__
+
+  def update(self, s0, s1):
+    """Moves the piece on square s0 to square s1. Returns its index"""
+    index = self.mailbox[s0]
+    if index is None: raise InvalidPieceOperation(f'cannot update piece')
+    self.mailbox[s0] = None
+    self.mailbox[s1] = index
+    self[index] = SQUARE_BITBOARDS[s1]
+    return index
+
+  def insert(self, square, pieceType, color, index=None):
+    """Inserts a piece into the given slot, or by finding an empty slot.
+    Returns its index"""
+    if index is None:
+      start,end = self.colorRanges[color]
+      for index in range(start,end):
+        # slot must be empty and the index must be for
+        # the correct type of the piece to be inserted
+        indexCanStorePiece = self[index] == 0 \
+                         and self.typeLookup[index]  == pieceType \
+                         and self.colorLookup[index] == color
+        if indexCanStorePiece: break
+      else:
+        raise InvalidPieceOperation(f'cannot insert piece')
     self.colorCounts[color] += 1
-    start,end = self.colorRanges[color]
-    for index in range(start,end):
-      # slot must be empty and the index must be for
-      # the correct type of the piece to be inserted
-      indexCanStorePiece = self[index] == 0 \
-                       and self.typeLookup[index]  == pieceType \
-                       and self.colorLookup[index] == color
-
-      if indexCanStorePiece:
-        self[index] = piece
-        return
-    raise InvalidPieceOperation(f'cannot insert piece')
-
-  def remove(self, piece, color):
-    """Removes a piece by setting its value equal to 0"""
-    self.colorCounts[color] -= 1
-    start,end = self.colorRanges[color]
-    for index in range(start,end):
-      if self[index] == piece:
-        self[index] = 0
-        # self.emptySlots.add(index)
-        return self.typeLookup[index]
-    raise InvalidStateUpdateException(f'cannot remove piece')
+    self.mailbox[square] = index
+    self[index] = SQUARE_BITBOARDS[square]
+    return index
+
+  def remove(self, square):
+    """Removes the piece on the square by setting its value equal to 0.
+    Returns its index"""
+    index = self.mailbox[square]
+    if index is None: raise InvalidStateUpdateException(f'cannot remove piece')
+    self.colorCounts[self.colorLookup[index]] -= 1
+    self.mailbox[square] = None
+    self[index] = 0
+    return index
 
   def get_color(self, color):
     """Returns all pieces of the given color"""
@@ -90,6 +188,14 @@ class PieceSet(list):
       if piece == 0: continue
       yield piece,self.typeLookup[index]
 
+  def get_color_squares(self, color):
+    """Returns the square index and type of all pieces of the given color"""
+    start,stop = self.colorRanges[color]
+    for index in range(start,stop):
+      piece = self[index]
+      if piece == 0: continue
+      yield 64 - piece.bit_length(),self.typeLookup[index]
+
   def size(self, color):
     return self.colorCounts[color]
 
@@ -97,12 +203,20 @@ class State:
   """Board Representation
 
   Can be updated with moves backwards and forwards. Impements Zobrist
-  hashing. State properties: PieceSet and occupancy bitboards (for all
-  pieces, for each color, and for each piece type). Printing it will
-  print a formatted board string.
+  hashing, along with pawn and material hashes for caches of pawn structure
+  and material evaluations. State properties: PieceSet, occupancy bitboards (for all
+  pieces, for each color, and for each piece type) and attack maps (for
+  each piece and each color). Printing it will print a formatted board
+  string.
   """
 
-  def __init__(self, colorToMove, pieces):
+  # attack lookup tables and the flat zobrist table, shared by all
+  # states. Being class attributes, they
+  # aren't pickled along with a state.
+  attackTables = None
+  hashTable = None
+
+  def __init__(self, colorToMove, pieces, castlingRights=0, enPassantFile=None):
     self.colorToMove = colorToMove
     self.pieces = PieceSet(pieces)
 
@@ -117,89 +231,263 @@ class State:
       self.colors[pieceColor] |= piece
       self.occupied |= piece
 
-    # load zobrist table from file then compute initial hash value
-    self.hashTable = chess.pregame.load_hash_values()
-    pieceHashValues = map(self.hashTable.__getitem__, self.pieces)
-    self.hash = reduce(operator.xor, pieceHashValues, 0)
+    # rights whose king or rook isn't on its home square are lost, and an
+    # en passant file is only kept if a pawn can capture en passant
+    for right,squares in enumerate(CASTLING_SQUARES):
+      king,rook = (SQUARE_BITBOARDS[square] for square in squares)
+      colorPieces = self.colors[right >> 1]
+      if king & self.pieceTypes[5] & colorPieces == 0 \
+          or rook & self.pieceTypes[3] & colorPieces == 0:
+        castlingRights &= ~(1 << right)
+    if enPassantFile is not None:
+      # the pushed pawn is on the 4th rank for white, the 5th for black
+      pawnSquare = (4 if colorToMove else 3)*8 + enPassantFile
+      enPassantFile = self.find_en_passant_file(pawnSquare, not colorToMove)
+
+    # compute initial zobrist hash values. The material hash has the key of
+    # square n for the (n+1)th piece of each type and color.
+    if State.hashTable is None:
+      State.hashTable = chess.pregame.load_hash_values()
+    self.hash = self.pawnHash = self.materialHash = 0
+    pieceCounts = [0]*12
+    for piece, pieceType, pieceColor in self.pieces:
+      base = (pieceColor*6 + pieceType) << 6
+      pieceHash = self.hashTable[base + get_square(piece)]
+      self.hash ^= pieceHash
+      if pieceType == 0: self.pawnHash ^= pieceHash
+      self.materialHash ^= self.hashTable[base + pieceCounts[base >> 6]]
+      pieceCounts[base >> 6] += 1
+    if colorToMove: self.hash ^= self.hashTable[SIDE_TO_MOVE_HASH_INDEX]
+    self.castlingRights, self.enPassantFile = 0, None
+    self.update_rights(castlingRights, enPassantFile)
     self.history = []
+    # castling rights and en passant file before each move, for unmaking
+    self.rightsHistory = []
+
+    # attack maps: one attack bitboard per piece set slot of each color
+    # (0 for captured pieces) and their union for each color
+    if State.attackTables is None: State.attackTables = AttackTables()
+    self.sliders = [[index for index in range(start,end)
+                     if self.pieces.typeLookup[index] in (2,3,4)]
+                    for start,end in self.pieces.colorRanges]
+    self.attacks = [], []
+    for index in range(self.pieces.numPieces):
+      piece, color = self.pieces[index], self.pieces.colorLookup[index]
+      pieceAttacks = 0 if piece == 0 else State.attackTables.find_piece_attacks(
+        get_square(piece), self.pieces.typeLookup[index], color, self.occupied)
+      self.attacks[color].append(pieceAttacks)
+    self.attackSets = [reduce(operator.or_, attacks, 0)
+                       for attacks in self.attacks]
+    # attacks replaced by each move and the slot of the piece it captured,
+    # for unmaking
+    self.attackHistory = []
 
   def __add__(self, move):
-    """Applies a move"""
+    """Applies a move (packed into an int, see chess/moves.py). None is a
+    null move, which passes the turn"""
     self.history.append(move)
+    if move is None: return self._pass_turn()
     return self._update(move)
 
   def __sub__(self, move):
     """Reverts a move"""
     self.history.pop()
+    if move is None: return self._pass_turn(reverse=True)
     return self._update(move, reverse=True)
 
+  def _pass_turn(self, reverse=False):
+    """Helper. Should not be called directly."""
+    if reverse:
+      self.update_rights(*self.rightsHistory.pop())
+    else:
+      self.rightsHistory.append((self.castlingRights, self.enPassantFile))
+      if self.enPassantFile is not None:
+        self.update_rights(self.castlingRights, None)
+    self.hash ^= self.hashTable[SIDE_TO_MOVE_HASH_INDEX]
+    self.colorToMove = not self.colorToMove
+    return self
+
   def _update(self, move, reverse=False):
     """Helper. Should not be called directly."""
 
+    # unpack the move's squares, piece type and captured piece type
+    startSquare,endSquare = move & 63, move >> 6 & 63
+    start,end = SQUARE_BITBOARDS[startSquare], SQUARE_BITBOARDS[endSquare]
+    pieceType = move >> 12 & 7
+    captureCode = move >> 16 & 7
+    captureType = captureCode - 1 if captureCode else None
+
     # define old/updated piece and moving color depending on move direction
-    p0,p1 = (move.end,move.start) if reverse else (move.start,move.end)
+    p0,p1 = (end,start) if reverse else (start,end)
+    s0,s1 = (endSquare,startSquare) if reverse else (startSquare,endSquare)
     color = not self.colorToMove if reverse else self.colorToMove
 
-    # update piece set
-    self.pieces.update(p0, p1, color)
+    # update piece set. A captured piece is removed first, so the mailbox
+    # square is free for the moving piece.
+    moveIsACapture = captureType is not None
+    captureIndex = None
+    if moveIsACapture and not reverse:
+      captureIndex = self.pieces.remove(s1)
+    index = self.pieces.update(s0, s1)
 
     # Bitwise subtract the old piece from occupancy bitboards
-    self.pieceTypes[move.pieceType] &= ~p0
+    self.pieceTypes[pieceType] &= ~p0
     self.colors[color] &= ~p0
 
     # Bitwise union the updated piece from occupancy bitboards.
-    self.pieceTypes[move.pieceType] |= p1
+    self.pieceTypes[pieceType] |= p1
     self.colors[color] |= p1
 
-    moveIsACapture = move.captureType is not None
     if reverse and moveIsACapture:
-      # reversed capture, insert captured piece back into piece set.
-      self.pieces.insert(p0, move.captureType, not color)
-      self.pieceTypes[move.captureType] |= p0
+      # reversed capture, insert captured piece back into piece set, in
+      # the slot it was captured from
+      captureIndex = self.attackHistory[-1][2]
+      self.pieces.insert(s0, captureType, not color, captureIndex)
+      self.pieceTypes[captureType] |= p0
       self.colors[not color] |= p0
     elif moveIsACapture:
-      # forward capture: remove captured piece from piece set
-      self.pieces.remove(p1, not color)
+      # forward capture: the captured piece left the piece set above
       self.colors[not color] &= ~p1
 
       # subtract piece from pieceType occupancy bitboard unless
       # the piece captured a piece of the same type
-      if move.pieceType != move.captureType:
-        self.pieceTypes[move.captureType] &= ~p1
+      if pieceType != captureType:
+        self.pieceTypes[captureType] &= ~p1
 
     # update board occupation with updated color bitboards
     self.occupied = self.colors[0] | self.colors[1]
 
+    if reverse:
+      self.restore_attacks()
+    else:
+      # a capture leaves the end square occupied
+      changed = p0 if moveIsACapture else p0|p1
+      self.update_attacks(changed, s1, color, index, captureIndex)
+
     # update zobrist hash by XORing in/out the old/updated piece
-    self.update_hash(p0, p1, color, move.pieceType, move.captureType, reverse)
-    self.hash ^= 0xF8D626AAAF278509
+    self.update_hash(startSquare, endSquare, color, pieceType, captureType)
+    self.hash ^= self.hashTable[SIDE_TO_MOVE_HASH_INDEX]
+
+    # update castling rights and the en passant file
+    if reverse:
+      castlingRights, enPassantFile = self.rightsHistory.pop()
+    else:
+      self.rightsHistory.append((self.castlingRights, self.enPassantFile))
+      castlingRights = self.castlingRights & CASTLING_RIGHTS_KEPT[startSquare] \
+                                           & CASTLING_RIGHTS_KEPT[endSquare]
+      enPassantFile = None
+      if pieceType == 0 and (endSquare - startSquare) in (16, -16):
+        enPassantFile = self.find_en_passant_file(endSquare, color)
+    if castlingRights != self.castlingRights \
+        or enPassantFile != self.enPassantFile:
+      self.update_rights(castlingRights, enPassantFile)
 
     # update turn
     self.colorToMove = not self.colorToMove
 
     return self
 
-  def update_hash(self, pieceIn, pieceOut, color,
-                  movedPieceType, removedPieceType, reverse):
-    """Rolling Zobrist Hash"""
-
-    # XOR out the piece bitboard before move
-    self.hash ^= self.hashTable[(pieceOut, movedPieceType, color)]
+  def update_attacks(self, changed, square, color, index, captureIndex=None):
+    """Incremental Attack Maps
 
-    # XOR in the updated piece
-    self.hash ^= self.hashTable[(pieceIn, movedPieceType, color)]
-
-    # if move was a capture, XOR out captured piece
-    if removedPieceType is not None:
-      removedPiece = pieceOut if reverse else pieceIn
-      self.hash ^= self.hashTable[(removedPiece, removedPieceType, not color)]
+    Only attacks that depend on the changed squares are recomputed: the
+    moved piece's, the captured piece's (which become 0) and those of the
+    sliders whose attacks reach a changed square. A slider whose rays
+    don't reach the changed squares is blocked before them, so its attacks
+    stay the same. The moved piece is given by its slot index and its new
+    square. The replaced attack bitboards (and the captured piece's slot)
+    are saved for unmaking.
+    """
+    pieces, attacks = self.pieces, self.attacks
+    find_piece_attacks = State.attackTables.find_piece_attacks
+    replaced = [] # (color, slot, attacks before the move)
+
+    start = pieces.colorRanges[color][0]
+    replaced.append((color, index-start, attacks[color][index-start]))
+    attacks[color][index-start] = find_piece_attacks(
+      square, pieces.typeLookup[index], color, self.occupied)
+
+    if captureIndex is not None:
+      start = pieces.colorRanges[not color][0]
+      replaced.append((not color, captureIndex-start,
+                       attacks[not color][captureIndex-start]))
+      attacks[not color][captureIndex-start] = 0
+
+    for sliderColor in (0,1):
+      start = pieces.colorRanges[sliderColor][0]
+      colorAttacks = attacks[sliderColor]
+      for slider in self.sliders[sliderColor]:
+        sliderAttacks = colorAttacks[slider-start]
+        if sliderAttacks & changed == 0 or slider == index: continue
+        replaced.append((sliderColor, slider-start, sliderAttacks))
+        colorAttacks[slider-start] = find_piece_attacks(
+          64 - pieces[slider].bit_length(), pieces.typeLookup[slider],
+          sliderColor, self.occupied)
+
+    self.attackHistory.append((replaced, self.attackSets[:], captureIndex))
+    self.attackSets[0] = reduce(operator.or_, attacks[0])
+    self.attackSets[1] = reduce(operator.or_, attacks[1])
+
+  def restore_attacks(self):
+    """Reverts the attack maps to before the last move"""
+    replaced, attackSets, _ = self.attackHistory.pop()
+    for color, slot, pieceAttacks in replaced:
+      self.attacks[color][slot] = pieceAttacks
+    self.attackSets[:] = attackSets
+
+  def update_hash(self, startSquare, endSquare, color, pieceType, captureType):
+    """Rolling Zobrist Hash, and the pawn and material hashes
+
+    XORs the moved piece out of its start square and into its end square,
+    and the captured piece out of the end square. Applying a move's update
+    again reverts it.
+    """
+    hashTable = self.hashTable
+    base = (color*6 + pieceType) << 6
+    pieceHash = hashTable[base + startSquare] ^ hashTable[base + endSquare]
+    self.hash ^= pieceHash
+    if pieceType == 0: self.pawnHash ^= pieceHash
+
+    if captureType is not None:
+      base = ((not color)*6 + captureType) << 6
+      captureHash = hashTable[base + endSquare]
+      self.hash ^= captureHash
+      if captureType == 0: self.pawnHash ^= captureHash
+
+      # key of the captured piece's count, without it, of its type and color
+      others = self.pieceTypes[captureType] & self.colors[not color] \
+             & ~SQUARE_BITBOARDS[endSquare]
+      self.materialHash ^= hashTable[base + bin(others).count('1')]
+
+  def update_rights(self, castlingRights, enPassantFile):
+    """Sets the castling rights and en passant file, and XORs their keys
+    in and out of the hash"""
+    changedRights = castlingRights ^ self.castlingRights
+    for right in range(4):
+      if changedRights >> right & 1:
+        self.hash ^= self.hashTable[CASTLING_HASH_INDEX + right]
+    if self.enPassantFile is not None:
+      self.hash ^= self.hashTable[EN_PASSANT_HASH_INDEX + self.enPassantFile]
+    if enPassantFile is not None:
+      self.hash ^= self.hashTable[EN_PASSANT_HASH_INDEX + enPassantFile]
+    self.castlingRights, self.enPassantFile = castlingRights, enPassantFile
+
+  def find_en_passant_file(self, square, color):
+    """File of a pawn of the color that was pushed two squares to the
+    square, if an enemy pawn next to it can capture it en passant"""
+    file = square & 7
+    neighbors = (SQUARE_BITBOARDS[square-1] if file > 0 else 0) \
+              | (SQUARE_BITBOARDS[square+1] if file < 7 else 0)
+    pawns = self.pieceTypes[0] & self.colors[not color]
+    if neighbors & pawns == 0 or SQUARE_BITBOARDS[square] & self.pieceTypes[0] == 0:
+      return None
+    return file
 
   def get_piece_type(self, piece):
-    """Finds the given piece and returns its type"""
-    for pieceType, pieceSet in enumerate(self.pieceTypes):
-      if piece & pieceSet != 0:
-        return pieceType
-    raise PieceNotFoundException('Could not find piece type')
+    """Finds the given piece (a single square bitboard) and returns its type"""
+    index = self.pieces.mailbox[64 - piece.bit_length()] if piece else None
+    if index is None: raise PieceNotFoundException('Could not find piece type')
+    return self.pieces.typeLookup[index]
 
   def __str__(self):
     """Returns a formatted board string"""
@@ -214,7 +502,55 @@ class State:
 
 def create_initial_position():
   """Returns initial State, which can be configured in settings.py"""
-  return State(0, chess.pregame.load_initial_pieces())
+  return State(0, chess.pregame.load_initial_pieces(), ALL_CASTLING_RIGHTS)
+
+def create_position(fen):
+  """Returns the State described by a FEN string
+
+  The move counters are ignored. Castling rights and the en passant square
+  are only hashed, since the engine doesn't play those moves. Every piece needs an empty piece set slot of
+  its type, so there can't be more pieces of a type than in the initial
+  position (e.g. after a promotion).
+  """
+  fields = fen.split()
+  if len(fields) < 2 or fields[1] not in ('w','b'):
+    raise InvalidFenException(f'invalid fen \'{fen}\'')
+  placement, colorToMove = fields[0].replace('/', ''), int(fields[1] == 'b')
+
+  numPieces,typeLookup,colorLookup,_ = chess.pregame.load_piece_index_values()
+  pieces = [0]*numPieces
+
+  square = 0
+  for char in placement:
+    if char.isdigit():
+      square += int(char)
+      continue
+    if char.lower() not in 'pnbrqk' or square > 63:
+      raise InvalidFenException(f'invalid fen \'{fen}\'')
+
+    pieceType, color = 'pnbrqk'.index(char.lower()), int(char.islower())
+    for index in range(numPieces):
+      if pieces[index] == 0 and typeLookup[index] == pieceType \
+          and colorLookup[index] == color:
+        pieces[index] = 1 << (63-square)
+        break
+    else:
+      raise InvalidPieceOperation(f'no piece set slot for \'{char}\'')
+    square += 1
+
+  if square != 64:
+    raise InvalidFenException(f'invalid fen \'{fen}\'')
+
+  castlingRights, enPassantFile = 0, None
+  if len(fields) > 2 and fields[2] != '-':
+    if any(char not in CASTLING_RIGHTS for char in fields[2]):
+      raise InvalidFenException(f'invalid fen \'{fen}\'')
+    castlingRights = sum(1 << CASTLING_RIGHTS.index(char) for char in fields[2])
+  if len(fields) > 3 and fields[3] != '-':
+    if fields[3][0] not in 'abcdefgh':
+      raise InvalidFenException(f'invalid fen \'{fen}\'')
+    enPassantFile = 'abcdefgh'.index(fields[3][0])
+  return State(colorToMove, pieces, castlingRights, enPassantFile)
 
 #################################################################
 # PGN PARSING: IN PROGRESS                                 #
@@ -17,7 +17,7 @@ class Evaluator:
 
   def __init__(self):
 
-    self.pieceSquareTables = chess.pregame.load_piece_square_tables()
+    self.pieceSquareTables = chess.pregame.load_piece_square_tables(bySquare=True)
     self.masks = chess.pregame.load_evaluation_masks()
 
     self.pieceValues = (
@@ -43,11 +43,14 @@ class Evaluator:
     )
 
     self.memo = [{} for _ in range(len(Evaluator.MODES))]
+    self.cacheProbes = self.cacheHits = 0
 
   def __call__(self, state, *args, mode=NORMAL):
     """Main Evaluation function"""
 
+    self.cacheProbes += 1
     if state.hash in self.memo[mode]:
+      self.cacheHits += 1
       return self.memo[mode][state.hash]
 
 
@@ -67,6 +70,10 @@ class Evaluator:
 
     return valuation
 
+  def capture_value(self, pieceType):
+    """Weighted material gained by capturing a piece of the given type"""
+    return self.pieceValues[pieceType] * self.weights[0]
+
   def score(func):
     """Evaluation Feuture to be used in the Linear Combination"""
     def decorator(self, *args):
@@ -92,7 +99,7 @@ class Evaluator:
     For each piece, a piece square table contains a score for every
     square indicating the strength of a square for that piece.
     """
-    pieces =  state.pieces.get_color(color)
+    pieces =  state.pieces.get_color_squares(color)
     tables = self.pieceSquareTables[color]
     pst_values = map(lambda piece: tables[piece[1]][piece[0]], pieces)
     return sum(pst_values) / state.pieces.size(color)
@@ -2,182 +2,637 @@
 """Move Generation and Ordering"""
 
 from collections import namedtuple
-from queue import PriorityQueue
 
 from chess import pregame
-
-# todo: remove fields not needed outside this file
-Move = namedtuple('Move', ('start', 'end', 'pieceType', 'color', 'captureType',
-                           'captureStrength', 'isPrincipleVariation'))
-
-class MoveOrdering(PriorityQueue):
-  """Orders moves based on their potential"""
+from chess.board import SQUARE_BITBOARDS, FULL_BOARD, AttackTables, get_square
+
+class InvalidMoveException(Exception): pass
+
+# Moves are packed into ints:
+#   bits 0-5    start square (0 is a8, see board.py)
+#   bits 6-11   end square
+#   bits 12-14  piece type
+#   bit  15     color
+#   bits 16-18  captured piece type + 1, or 0 if the move isn't a capture
+# The low 16 bits (squares, piece type and color) index the history table.
+MOVE_BITS = 19
+MOVE_MASK = (1 << MOVE_BITS) - 1
+CAPTURE_MASK = 7 << 16
+
+# Deepest ply the principle variation, killer and move list tables can hold
+MAX_PLY = 64
+
+# Move priorities, lowest first. Killers and counter moves come first among
+# quiet moves, then the remaining quiet moves ranked by history score.
+PRINCIPLE_VARIATION_PRIORITY = 0
+KILLER_PRIORITIES = (6, 6.1)
+COUNTER_MOVE_PRIORITY = 6.2
+HISTORY_PRIORITY_RANGE = (6.3, 7)
+BAD_CAPTURE_PRIORITY = 8
+
+# Captures that lose material by piece rank, but not by static exchange
+# evaluation, go after the MVV-LVA ordered captures
+SAFE_CAPTURE_PRIORITY = 5.5
+
+# Piece values in pawns for static exchange evaluation, by piece type. The
+# king can't be captured, so it is worth more than everything else.
+EXCHANGE_VALUES = (1, 3, 3, 5, 9, 100)
+
+# Masks for setwise pawn moves. Pawns that reach the 3rd rank (or the 6th
+# for black) with a single push can push again.
+FILE_A = sum(SQUARE_BITBOARDS[square] for square in range(0, 64, 8))
+FILE_H = sum(SQUARE_BITBOARDS[square] for square in range(7, 64, 8))
+PAWN_DOUBLE_PUSH_RANKS = (sum(SQUARE_BITBOARDS[40:48]),
+                          sum(SQUARE_BITBOARDS[16:24]))
+
+# Restrictions on the side to move's moves, see Generator.find_pins_and_checks
+Legality = namedtuple('Legality', ('checkers', 'checkMask', 'pins', 'xrays'))
+
+def get_piece_rank(pieceType):
+  """Piece rank used for capture strength. Knights and bishops are equal"""
+  return pieceType-1 if pieceType >= 2 else pieceType
+
+def create_move(start, end, pieceType, color, captureType=None):
+  """Packs a move. Start and end are bitboards."""
+  captureCode = 0 if captureType is None else captureType + 1
+  return get_square(start) | get_square(end) << 6 \
+       | pieceType << 12 | color << 15 | captureCode << 16
+
+def get_start(move):
+  return SQUARE_BITBOARDS[move & 63]
+
+def get_end(move):
+  return SQUARE_BITBOARDS[move >> 6 & 63]
+
+def get_piece_type(move):
+  return move >> 12 & 7
+
+def get_color(move):
+  return move >> 15 & 1
+
+def is_capture(move):
+  return move & CAPTURE_MASK != 0
+
+def get_capture_type(move):
+  """Type of the captured piece, or None"""
+  captureCode = move >> 16 & 7
+  return captureCode - 1 if captureCode else None
+
+def get_capture_strength(move):
+  """Captured piece rank minus the capturing piece's rank"""
+  return get_piece_rank((move >> 16 & 7) - 1) - get_piece_rank(move >> 12 & 7)
+
+def get_move_notation(move):
+  """Long algebraic notation, e.g. e2e4"""
+  def get_square_notation(square):
+    return 'abcdefgh'[square % 8] + str(8 - square // 8)
+  return get_square_notation(move & 63) + get_square_notation(move >> 6 & 63)
+
+def parse_move_notation(state, notation):
+  """Move on the given state from long algebraic notation, e.g. e2e4
+
+  The move isn't checked for legality. A promotion suffix is ignored.
+  """
+  def parse_square_notation(squareNotation):
+    file, rank = 'abcdefgh'.index(squareNotation[0]), int(squareNotation[1])
+    return SQUARE_BITBOARDS[8*(8-rank) + file]
+
+  try:
+    start, end = map(parse_square_notation, (notation[0:2], notation[2:4]))
+  except (ValueError, IndexError):
+    raise InvalidMoveException(f'invalid move \'{notation}\'')
+
+  color = state.colorToMove
+  if start & state.colors[color] == 0:
+    raise InvalidMoveException(f'no piece to move for \'{notation}\'')
+  captureType = None
+  if end & state.colors[not color] != 0:
+    captureType = state.get_piece_type(end)
+  return create_move(start, end, state.get_piece_type(start), color, captureType)
+
+class MoveOrdering:
+  """Move list ordered by priority, lowest first
+
+  Priorities are scaled to ints and stored above the move bits, so entries
+  are plain ints that are sorted once, when the first move is taken. Moves
+  with equal priority are ordered by start square and then end square,
+  highest index (h1) first. The generator keeps one list per ply and reuses
+  it.
+  """
+
+  PRIORITY_SCALE = 1024
+  TIE_BREAK_SHIFT = MOVE_BITS
+  PRIORITY_SHIFT = MOVE_BITS + 12
 
   def __init__(self):
-    super().__init__()
-    self.size = 0
-
-  def push(self, move):
-    if move.isPrincipleVariation:  priority = 0
-    elif move.captureType is None: priority = 6
-    elif move.captureStrength < 0: priority = 7
-    else:                          priority = 5-move.captureStrength
+    self.entries = []
+    self.isSorted = False
 
-    self.put((priority,move))
-    self.size += 1
+  def push(self, move, priority):
+    priority = int(priority * MoveOrdering.PRIORITY_SCALE)
+    tieBreak = 4095 - ((move & 63) << 6 | move >> 6 & 63)
+    self.entries.append(priority << MoveOrdering.PRIORITY_SHIFT
+                        | tieBreak << MoveOrdering.TIE_BREAK_SHIFT | move)
+    self.isSorted = False
 
   def clear(self):
-    self.size = 0
-    super().clear()
+    self.entries.clear()
+    self.isSorted = False
 
-  def pop(self):
-    self.size -= 1
-    priority,move = self.get()
-    return move
+  def sort(self):
+    if not self.isSorted:
+      self.entries.sort(reverse=True)
+      self.isSorted = True
 
-  def __len__(self):
-    return self.size
+  def pop(self):
+    self.sort()
+    return self.entries.pop() & MOVE_MASK
 
-class Generator:
-  """Legal Move Generator"""
+  def next_priority(self):
+    """Priority of the move pop() returns next"""
+    self.sort()
+    entry = self.entries[-1] >> MoveOrdering.PRIORITY_SHIFT
+    return entry / MoveOrdering.PRIORITY_SCALE
 
-  def __init__(self):
-    self.masks = pregame.load_move_masks()
-    self.moves, self.movesets = pregame.load_move_cache()
-    self.bishopMagic,self.rookMagic = pregame.load_magic()
+  def __len__(self):
+    return len(self.entries)
 
-    self.principleVariations = {}
+class Generator(AttackTables):
+  """Legal Move Generator
 
-  def find_attacks(self, state): # param should be pieces param
-    """Generates attack bitboards for all pieces of both colors
+  Moves are legal: pinned pieces stay on their pin and checks have to be
+  answered. Castling, en passant and promotions aren't generated.
+  """
 
-    Pawn, Knight, and King attacks are generated by retrieving hashed
-    move bitboards (precomputed in pregame) and bitwise subtracting
-    occupancy bitboards. Sliding Pieces attacks are generated using
-    magic bitboards.
+  def __init__(self):
+    AttackTables.__init__(self)
+    self.masks = pregame.load_move_masks(bySquare=True)
+
+    # triangular principle variation table. Row n holds the best line
+    # found from ply n, which is built from the row below it.
+    self.principleVariations = [[None]*MAX_PLY for _ in range(MAX_PLY)]
+    self.principleVariationLengths = [0]*MAX_PLY
+    self.previousPrincipleVariation = []
+
+    # quiet move ordering heuristics, updated on beta cutoffs. Killers are
+    # stored per ply, history scores by the low 16 bits of the move
+    # (from/to/piece/color) and counter moves by the destination, piece and
+    # color of the move they answer.
+    self.killers = [[None, None] for _ in range(MAX_PLY)]
+    self.history = [0] * (1 << 16)
+    self.counterMoves = [None] * (1 << 10)
+    self.maxHistory = 0
+
+    # reusable move lists, one per ply (and one for captures while
+    # picking moves in stages)
+    self.moveLists = [MoveOrdering() for _ in range(MAX_PLY)]
+    self.captureLists = [MoveOrdering() for _ in range(MAX_PLY)]
+
+  def find_attacks(self, state):
+    """Attack bitboards of each piece, and of each color
+
+    The state keeps its attack maps up to date as moves are made and
+    unmade (see State.update_attacks), so they are returned as they are.
+    attacks[color] has one bitboard per piece set slot of the color, which
+    is 0 for captured pieces. The lists belong to the state and are only
+    valid while it is in the same position.
     """
-
-    attacks = [],[]
-    attackSets = [0]*2
-
-    # Iterating state.pieces will always result in same order
-    for piece,pieceType,color in state.pieces:
-
-      #PAWN: retrieve precomputed, hashed attack set (with color)
-      if pieceType == 0:
-        pieceAttacks = self.movesets[pieceType][color][piece][1]
-
-      # KING AND KNIGHT: retrieve precomputed, hashed attack set
-      elif pieceType == 5 or pieceType == 1:
-        pieceAttacks = self.movesets[pieceType][piece]
-
-      # ROOK/BISHOP: rank + file moves or diagonal + antidiagonal moves
-      elif pieceType == 2 or pieceType == 3:
-        args = (piece,pieceType,state.occupied)
-        pieceAttacks = self.search_magic_cache(*args)
-
-      # QUEEN: rank + file + diagonal + antidiagonal moves
-      elif pieceType == 4:
-        # combine bishop and rook attacks
-        straights = self.search_magic_cache(piece, 2, state.occupied)
-        diagonals = self.search_magic_cache(piece, 3, state.occupied)
-        pieceAttacks = straights | diagonals
-
-
-      attacks[color].append(pieceAttacks)
-      attackSets[color] |= pieceAttacks
-
-    return attacks, attackSets
-
-  def search_magic_cache(self, piece, pieceType, occupied):
-    """Magic Bitboards"""
-    magic = self.bishopMagic if pieceType == 2 else self.rookMagic
-    blockers = magic.attacks[piece] & occupied
-    magicBitboard = magic.bitboards[piece]
-    numAttackIndecies = magic.indecies[piece]
-    magicKey = (blockers * magicBitboard) >> (64 - numAttackIndecies)
-    return magic.cache[piece][magicKey]
+    return state.attacks, state.attackSets
 
   def find_captures(self, state, attacks, attackSets):
+    """Returns a Move Ordering with captures only"""
     return self.find_moves(state, attacks, attackSets, minCaptureStrength = -6)
 
-  def find_strong_captures(self, state, attacks, attackSets, findTrades=False):
-    return self.find_moves(state, attacks, attackSets,
-                           minCaptureStrength = 0 if findTrades else 1)
+  def get_move_list(self, moveLists, ply):
+    """The ply's reusable move list, emptied, or a new one without a ply"""
+    if ply is None or ply >= MAX_PLY: return MoveOrdering()
+    moves = moveLists[ply]
+    moves.clear()
+    return moves
 
-  def find_moves(self, state, attacks, attackSets, minCaptureStrength=None):
-    """Returns a Move Ordering Priority Queue with legal moves"""
+  def find_moves(self, state, attacks, attackSets, minCaptureStrength=None,
+                 pvMove=None, ply=None):
+    """Returns a Move Ordering with legal moves
 
+    If a principle variation move is given, it gets the highest priority.
+    Quiet moves are ranked by the killer, counter move and history tables.
+    With a ply, the ply's killers are used and the move list is the ply's
+    reusable list, which is only valid until moves are generated at the same
+    ply again.
+    """
     onlyCaptures = minCaptureStrength is not None
-    moves = MoveOrdering()
+    moves = self.get_move_list(self.moveLists, ply)
+    killers = self.killers[ply] if ply is not None and ply < MAX_PLY else ()
+    self.add_moves(moves, state, attacks, attackSets, True, not onlyCaptures,
+                   minCaptureStrength, pvMove, killers)
+    return moves
+
+  def pick_moves(self, state, attacks, attackSets, pvMove=None, ply=None):
+    """Staged Move Generation
+
+    Yields the legal moves in stages: the principle variation (or hash)
+    move, good captures in MVV-LVA order, killers, the remaining quiet
+    moves (counter move first, then by history score), and finally bad
+    captures. A stage is only generated once the stage before it has run
+    out, so a node that cuts off on an early move skips the rest of the
+    generation. Killers and the principle variation move come from other
+    positions, so they are checked to be legal here first.
+    """
+    legality = self.find_pins_and_checks(state)
+    if pvMove is not None \
+        and self.is_valid_move(state, pvMove, attackSets, legality):
+      yield pvMove
+    else:
+      pvMove = None
+
+    captures = self.get_move_list(self.captureLists, ply)
+    self.add_moves(captures, state, attacks, attackSets, True, False,
+                   legality=legality)
+    while len(captures) > 0 \
+        and captures.next_priority() < BAD_CAPTURE_PRIORITY:
+      move = captures.pop()
+      if move != pvMove: yield move
+
+    killers = self.killers[ply] if ply is not None and ply < MAX_PLY else ()
+    for killer in killers:
+      if killer is not None and killer != pvMove \
+          and self.is_valid_move(state, killer, attackSets, legality):
+        yield killer
+
+    quiets = self.get_move_list(self.moveLists, ply)
+    self.add_moves(quiets, state, attacks, attackSets, False, True,
+                   legality=legality)
+    while len(quiets) > 0:
+      move = quiets.pop()
+      if move != pvMove and move not in killers: yield move
+
+    while len(captures) > 0:
+      move = captures.pop()
+      if move != pvMove: yield move
+
+  def add_moves(self, moves, state, attacks, attackSets, captures, quiets,
+                minCaptureStrength=None, pvMove=None, killers=(),
+                legality=None):
+    """Pushes the legal captures and/or quiet moves with their priorities"""
+    if legality is None: legality = self.find_pins_and_checks(state)
+    checkMask, pins = legality.checkMask, legality.pins
+
+    counterMove = self.find_counter_move(state)
+    history = self.history
+    historyScale = self.maxHistory + 1
+    low,high = HISTORY_PRIORITY_RANGE
 
     color = state.colorToMove
     friends = state.colors[color]
     enemies = state.colors[not color]
     threatened = attackSets[not color]
 
-    pieceIndex = 0
-    for piece, pieceType in state.pieces.get_color(color):
-      pieceAttacks = attacks[color][pieceIndex]
-      pieceIndex+=1
-
-      # PAWN LEGAL MOVE MASK
+    # (piece bits, piece rank, target squares, start offset) for each set of
+    # moves. Unpinned pawns move setwise, so their start square is found
+    # from the end square and the offset.
+    moveSets = self.find_pawn_moves(state, captures, quiets, legality)
+
+    pieces = state.pieces
+    start,end = pieces.colorRanges[color]
+    for index in range(start, end):
+      piece = pieces[index]
+      if piece == 0: continue
+      pieceType = pieces.typeLookup[index]
+      if pieceType == 0 and piece not in pins: continue
+      pieceAttacks = attacks[color][index-start]
+
+      # check evasions: in double check only the king moves, and in single
+      # check pieces that can't reach the check mask are skipped
+      if pieceType != 5 and checkMask != FULL_BOARD:
+        if checkMask == 0: continue
+        if pieceType != 0 and pieceAttacks & checkMask == 0: continue
+
+      square = 64 - piece.bit_length()
+
+      # PINNED PAWN LEGAL MOVE MASK
       if pieceType == 0:
-        moveset,attackSet = self.movesets[0][color][piece]
+        moveset,attackSet = self.movesets[0][color][square]
 
-        blocker = self.masks.pawnBlockers[color][piece]
+        blocker = self.masks.pawnBlockers[color][square]
 
         pawnIsBlocked = blocker & state.occupied != 0
 
-        if pawnIsBlocked:
+        if pawnIsBlocked or not quiets:
           moveMask = 0
         else:
           moveMask = moveset & ~state.occupied
 
-        attackMask = attackSet & enemies
+        attackMask = attackSet & enemies if captures else 0
 
         legalMoveMask = attackMask | moveMask
 
       # KING LEGAL MOVE MASK
       elif pieceType == 5:
-        legalMoveMask = pieceAttacks & ~friends & ~threatened
+        legalMoveMask = pieceAttacks & ~friends & ~threatened & ~legality.xrays
 
       # KNIGHT, BISHOP, ROOK, QUEEN LEGAL MOVE MASK
       else:
         legalMoveMask = pieceAttacks & ~friends
 
-      # get cached move lists
-      if pieceType == 0: # PAWN
-        cachedMoves = self.moves[pieceType][color][piece]
-      else:
-        cachedMoves = self.moves[pieceType][piece]
-
-      for moveBitboard in cachedMoves:
-        if moveBitboard & legalMoveMask != 0:
-          isACapture = moveBitboard & enemies != 0
-          if isACapture:
-            captureType = state.get_piece_type(moveBitboard)
-
-            # piece rank sets bishop and knight to be same value
-            get_piece_rank = lambda pt: pt-1 if pt>=2 else pt
-
-            captureStrength = get_piece_rank(captureType) \
-                            - get_piece_rank(pieceType)
-
-            move = Move(piece, moveBitboard, pieceType, color,
-                        captureType, captureStrength, False)
-          else:
-            move = Move(piece, moveBitboard, pieceType,
-                        color, None, None, False)
-
-
-          if onlyCaptures and (move.captureType is None
-              or minCaptureStrength > move.captureStrength): continue
-
-          moves.push(move)
+      # other pieces have to answer a check and stay on their pin
+      if pieceType != 5:
+        legalMoveMask &= checkMask
+        if piece in pins: legalMoveMask &= pins[piece]
+
+      if not quiets: legalMoveMask &= enemies
+      elif not captures: legalMoveMask &= ~enemies
+      if legalMoveMask == 0: continue
+
+      # square, piece type and color bits are shared by the piece's moves
+      moveSets.append((square | pieceType << 12 | color << 15,
+                       get_piece_rank(pieceType), legalMoveMask, None))
+
+    for pieceBits,pieceRank,targets,offset in moveSets:
+      while targets:
+        target = targets & -targets
+        targets ^= target
+        endSquare = 64 - target.bit_length()
+        move = pieceBits | endSquare << 6
+        if offset is not None: move |= endSquare + offset
+
+        if target & enemies != 0:
+          captureType = state.get_piece_type(target)
+          captureStrength = get_piece_rank(captureType) - pieceRank
+          if minCaptureStrength is not None \
+              and minCaptureStrength > captureStrength: continue
+          move |= (captureType+1) << 16
+
+          # a capture by a more valuable piece is only bad if the
+          # exchange on the square loses material
+          if move == pvMove:           priority = PRINCIPLE_VARIATION_PRIORITY
+          elif captureStrength >= 0:   priority = 5-captureStrength
+          elif self.evaluate_exchange(state, move) < 0:
+                                       priority = BAD_CAPTURE_PRIORITY
+          else:                        priority = SAFE_CAPTURE_PRIORITY
+        elif move == pvMove:
+          priority = PRINCIPLE_VARIATION_PRIORITY
+        elif move in killers:
+          priority = KILLER_PRIORITIES[killers.index(move)]
+        elif move == counterMove:
+          priority = COUNTER_MOVE_PRIORITY
+        else:
+          priority = high - (high-low) * history[move] / historyScale
 
+        moves.push(move, priority)
 
-    return moves
+  def find_pawn_moves(self, state, captures, quiets, legality):
+    """Pushes and captures of the side to move's unpinned pawns, setwise
 
-  def set_a_principle_variation(self, state, move):
-    self.principleVariations[state] = move
+    The whole pawn bitboard is shifted at once. Square s is bit 63-s, so
+    moving up a rank (towards rank 8) is a left shift by 8, and captures
+    shift by 7 or 9. Pawns on the a or h file are masked out before
+    shifting their captures towards that edge, since the shift would wrap
+    them onto the other side of the board. Pinned pawns are left to
+    add_moves. Returns the move sets in add_moves's format: each end
+    square's pawn starts the offset away from it.
+    """
+    color = state.colorToMove
+    pawns = state.pieceTypes[0] & state.colors[color]
+    for pinned in legality.pins: pawns &= ~pinned
+    if pawns == 0: return []
+
+    checkMask = legality.checkMask
+    empty = ~state.occupied & FULL_BOARD
+    enemies = state.colors[not color] & checkMask
+    pawnBits = color << 15 # pawns are piece type 0
+
+    moveSets = []
+    if quiets:
+      if color == 0:
+        pushes = pawns << 8 & empty
+        doublePushes = (pushes & PAWN_DOUBLE_PUSH_RANKS[0]) << 8 & empty
+      else:
+        pushes = pawns >> 8 & empty
+        doublePushes = (pushes & PAWN_DOUBLE_PUSH_RANKS[1]) >> 8 & empty
+      forward = 8 if color == 0 else -8
+      moveSets.append((pawnBits, 0, pushes & checkMask, forward))
+      moveSets.append((pawnBits, 0, doublePushes & checkMask, 2*forward))
+
+    if captures:
+      if color == 0:
+        moveSets.append((pawnBits, 0, (pawns & ~FILE_A) << 9 & enemies, 9))
+        moveSets.append((pawnBits, 0, (pawns & ~FILE_H) << 7 & enemies, 7))
+      else:
+        moveSets.append((pawnBits, 0, (pawns & ~FILE_A) >> 7 & enemies, -7))
+        moveSets.append((pawnBits, 0, (pawns & ~FILE_H) >> 9 & enemies, -9))
+
+    return moveSets
+
+  def is_valid_move(self, state, move, attackSets, legality=None):
+    """Whether the move is one of the state's legal moves"""
+    startSquare = move & 63
+    start, end = SQUARE_BITBOARDS[startSquare], SQUARE_BITBOARDS[move >> 6 & 63]
+    pieceType, color = move >> 12 & 7, move >> 15 & 1
+    captureType = get_capture_type(move)
+
+    if color != state.colorToMove: return False
+    if start & state.colors[color] & state.pieceTypes[pieceType] == 0:
+      return False
+    if captureType is None:
+      if end & state.occupied != 0: return False
+    elif end & state.colors[not color] & state.pieceTypes[captureType] == 0:
+      return False
+
+    if legality is None: legality = self.find_pins_and_checks(state)
+    if pieceType == 5:
+      kingMask = self.movesets[5][startSquare] & ~attackSets[not color] & ~legality.xrays
+      return end & kingMask != 0
+    if end & legality.checkMask == 0: return False
+    if start in legality.pins and end & legality.pins[start] == 0: return False
+
+    if pieceType == 0:
+      moveset,attackSet = self.movesets[0][color][startSquare]
+      if captureType is not None: return end & attackSet != 0
+      blocker = self.masks.pawnBlockers[color][startSquare]
+      return end & moveset != 0 and blocker & state.occupied == 0
+    pieceAttacks = self.find_piece_attacks(startSquare, pieceType, color,
+                                           state.occupied)
+    return end & pieceAttacks != 0
+
+  def find_pins_and_checks(self, state):
+    """Checks and pins against the side to move's king
+
+    Checkers are the enemy pieces attacking the king. Against a single
+    checker, the other pieces can only capture it or block it, so they are
+    restricted to the check mask: the checker and the squares between it
+    and the king. In double check the mask is empty and only the king
+    moves. Pins map each pinned piece to the squares it can still move to
+    (between the king and the pinner, or the pinner itself). Xrays are the
+    squares behind the king on the lines of checking sliders. The attack
+    maps don't include them, since the king blocks the slider, but the king
+    can't step back onto them.
+    """
+    color = state.colorToMove
+    friends,enemies = state.colors[color],state.colors[not color]
+    pieceTypes = state.pieceTypes
+    king = pieceTypes[5] & friends
+    if king == 0: return Legality(0, FULL_BOARD, {}, 0)
+
+    # sliders are found by looking from the king square with the slider's
+    # own attacks (and pawns with the attacks of a friendly pawn)
+    diagonalSliders = (pieceTypes[2] | pieceTypes[4]) & enemies
+    straightSliders = (pieceTypes[3] | pieceTypes[4]) & enemies
+    kingSquare = get_square(king)
+    checkers = (self.movesets[0][color][kingSquare][1] & pieceTypes[0]
+              | self.movesets[1][kingSquare] & pieceTypes[1]) & enemies \
+             | self.search_magic_cache(kingSquare, 2, state.occupied) & diagonalSliders \
+             | self.search_magic_cache(kingSquare, 3, state.occupied) & straightSliders
+
+    between = self.masks.between[kingSquare]
+    lines = self.masks.lines[kingSquare]
+    checkMask,xrays = FULL_BOARD,0
+    if checkers != 0:
+      isDoubleCheck = checkers & (checkers-1) != 0
+      checkMask = 0 if isDoubleCheck \
+             else checkers | between[get_square(checkers)]
+      sliderCheckers = checkers & (diagonalSliders | straightSliders)
+      while sliderCheckers:
+        checker = sliderCheckers & -sliderCheckers
+        xrays |= lines[get_square(checker)] & ~checker
+        sliderCheckers ^= checker
+
+    # a pinner sees the king through exactly one friendly piece. Looking
+    # from the king with only the enemy pieces as blockers skips over the
+    # friendly pieces in the way.
+    pins = {}
+    pinners = (self.search_magic_cache(kingSquare, 2, enemies) & diagonalSliders
+             | self.search_magic_cache(kingSquare, 3, enemies) & straightSliders) \
+            & ~checkers
+    while pinners:
+      pinner = pinners & -pinners
+      pinRay = between[get_square(pinner)]
+      pinned = pinRay & friends
+      if pinned != 0 and pinned & (pinned-1) == 0:
+        pins[pinned] = pinRay | pinner
+      pinners ^= pinner
+
+    return Legality(checkers, checkMask, pins, xrays)
+
+  def find_attackers(self, state, square, occupied):
+    """Pieces of both colors attacking the square (an index), given the
+    occupancy. Pieces that aren't in the occupancy are left out."""
+    pieceTypes, colors = state.pieceTypes, state.colors
+    diagonalSliders = pieceTypes[2] | pieceTypes[4]
+    straightSliders = pieceTypes[3] | pieceTypes[4]
+    # pawns attacking the square are where a pawn of the other color on
+    # the square would attack
+    return (self.movesets[0][1][square][1] & pieceTypes[0] & colors[0]
+          | self.movesets[0][0][square][1] & pieceTypes[0] & colors[1]
+          | self.movesets[1][square] & pieceTypes[1]
+          | self.movesets[5][square] & pieceTypes[5]
+          | self.search_magic_cache(square, 2, occupied) & diagonalSliders
+          | self.search_magic_cache(square, 3, occupied) & straightSliders) \
+         & occupied
+
+  def evaluate_exchange(self, state, move):
+    """Static Exchange Evaluation
+
+    Material (in pawns, see EXCHANGE_VALUES) the moving side wins with a
+    capture, once the sequence of captures on the end square is resolved.
+    Each side recaptures with its least valuable attacker, and can stop
+    capturing when that is better. Sliders behind a piece that captured
+    (x-rays) join in once it has left its square. A king only recaptures
+    when the square isn't defended anymore.
+    """
+    square = move >> 6 & 63
+    pieceTypes, colors = state.pieceTypes, state.colors
+    diagonalSliders = pieceTypes[2] | pieceTypes[4]
+    straightSliders = pieceTypes[3] | pieceTypes[4]
+
+    occupied = state.occupied ^ SQUARE_BITBOARDS[move & 63]
+    attackers = self.find_attackers(state, square, occupied)
+    gains = [EXCHANGE_VALUES[get_capture_type(move)]]
+    pieceType = move >> 12 & 7 # the piece standing on the square
+    color = not move >> 15 & 1
+
+    while True:
+      sideAttackers = attackers & colors[color]
+      if sideAttackers == 0: break
+      for attackerType in range(6):
+        attacker = sideAttackers & pieceTypes[attackerType]
+        if attacker != 0: break
+      if attackerType == 5 and attackers & colors[not color] != 0: break
+
+      gains.append(EXCHANGE_VALUES[pieceType] - gains[-1])
+      pieceType = attackerType
+      attacker &= -attacker
+      occupied ^= attacker
+      attackers ^= attacker
+      if attackerType != 1 and attackerType != 5:
+        attackers |= (self.search_magic_cache(square, 2, occupied) & diagonalSliders
+                    | self.search_magic_cache(square, 3, occupied) & straightSliders) \
+                   & occupied
+      color = not color
+
+    # each side stands pat when capturing would lose more
+    for index in range(len(gains)-1, 0, -1):
+      gains[index-1] = min(gains[index-1], -gains[index])
+    return gains[0]
+
+  def find_counter_move(self, state):
+    """Counter move stored for the last move made"""
+    if not state.history or state.history[-1] is None: return None
+    return self.counterMoves[state.history[-1] >> 6 & 1023]
+
+  def update_move_ordering(self, state, move, ply, depth):
+    """Rewards a quiet move that caused a beta cutoff
+
+    The move becomes a killer at its ply and the counter move to the move
+    before it, and its history score grows with the remaining depth.
+    """
+    if is_capture(move): return
+
+    killers = self.killers[ply]
+    if killers[0] != move:
+      killers[1],killers[0] = killers[0],move
+
+    if state.history and state.history[-1] is not None:
+      self.counterMoves[state.history[-1] >> 6 & 1023] = move
+
+    index = move & 0xFFFF
+    self.history[index] += depth*depth
+    self.maxHistory = max(self.maxHistory, self.history[index])
+
+  def new_search(self):
+    """Resets per search state: the followed principle variation and the
+    killers. History scores are halved so older searches count less."""
+    self.previousPrincipleVariation = []
+    self.killers = [[None, None] for _ in range(MAX_PLY)]
+    self.history = [score >> 1 for score in self.history]
+    self.maxHistory >>= 1
+
+  def clear_principle_variation(self, ply):
+    """Empties the principle variation found from a ply"""
+    self.principleVariationLengths[ply] = ply
+
+  def set_a_principle_variation(self, ply, move):
+    """Sets the best line from a ply to the move followed by the best
+    line of the ply below it"""
+    line,childLine = self.principleVariations[ply:ply+2]
+    childLength = max(self.principleVariationLengths[ply+1], ply+1)
+    line[ply] = move
+    line[ply+1:childLength] = childLine[ply+1:childLength]
+    self.principleVariationLengths[ply] = childLength
+
+  def get_principle_variation(self):
+    """Best line found from the root"""
+    return self.principleVariations[0][:self.principleVariationLengths[0]]
+
+  def follow_principle_variation(self, line):
+    """Sets the line that gets searched first by the next search"""
+    self.previousPrincipleVariation = line
+
+  def find_principle_variation_move(self, state, ply):
+    """Next move of the followed line, if the moves leading to this ply
+    are the start of the line"""
+    line = self.previousPrincipleVariation
+    if ply >= len(line): return None
+    played = state.history[len(state.history)-ply:]
+    for move,lineMove in zip(played, line):
+      if move != lineMove: return None
+    return line[ply]
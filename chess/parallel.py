@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Parallel Search (Lazy SMP)"""
+
+import multiprocessing
+import random
+from collections import Counter
+
+import settings
+import chess.moves
+import chess.board
+from chess import search
+from chess.transposition import SharedTranspositionTable
+
+class SearchWorker:
+  """Searches the root position in a worker process
+
+  Workers search the same position but diverge on purpose: odd workers
+  start iterative deepening one ply deeper, and all but the first worker
+  add random noise to their history scores, so they order quiet moves
+  differently and explore different parts of the tree first. Each worker
+  keeps its generator and evaluator between moves, and attaches to the
+  pool's shared transposition table, through which workers share results.
+  """
+
+  def __init__(self, index, tableName):
+    self.index = index
+    self.generator = chess.moves.Generator()
+    self.evaluator = chess.board.Evaluator()
+    self.table = SharedTranspositionTable(name=tableName, create=False)
+    self.random = random.Random(index)
+
+  def search(self, state, maxTime, maxNodes, maxDepth):
+    limits = search.SearchLimits(maxTime, maxNodes)
+    if search.stats is not None:
+      search.stats.new_search(self.evaluator, self.table)
+    startDepth = 1 + self.index % 2
+
+    if self.index > 0:
+      history = self.generator.history
+      for index in range(len(history)):
+        history[index] += self.random.randrange(8)
+
+    evaluation, move, depth = search.iterative_deepening(
+      state, self.evaluator, self.generator, self.table, limits,
+      maxDepth, startDepth)
+
+    line = self.generator.previousPrincipleVariation
+    return evaluation, move, depth, line, limits.nodes, self.table.races
+
+def run_worker(index, tableName, connection):
+  """Worker process loop. Searches positions until it receives None."""
+  worker = SearchWorker(index, tableName)
+  while True:
+    args = connection.recv()
+    if args is None: break
+    connection.send(worker.search(*args))
+  worker.table.close()
+
+class SearchPool:
+  """Lazy SMP Search Pool
+
+  Starts worker processes which all search the same root position, each
+  with its own move ordering and search depths, and sharing one
+  transposition table in shared memory. Results are combined by taking the
+  deepest finished search, and among those the move most workers agree on.
+  """
+
+  def __init__(self, processes=settings.SEARCH_PROCESSES,
+               hashSize=settings.HASH_SIZE):
+    self.table = SharedTranspositionTable(hashSize)
+    self.connections, self.workers = [],[]
+    for index in range(processes):
+      connection, workerConnection = multiprocessing.Pipe()
+      worker = multiprocessing.Process(target=run_worker, daemon=True,
+                                       args=(index, self.table.name,
+                                             workerConnection))
+      worker.start()
+      self.connections.append(connection)
+      self.workers.append(worker)
+    self.nodes = self.races = 0
+
+  def search(self, state, maxTime=settings.SEARCH_TIME,
+             maxNodes=settings.SEARCH_NODES, maxDepth=settings.SEARCH_DEPTH):
+    """Returns the evaluation, best move, depth and principle variation
+
+    The node budget is split between the workers.
+    """
+    if maxNodes is not None: maxNodes //= len(self.workers)
+    self.table.new_search()
+    for connection in self.connections:
+      connection.send((state, maxTime, maxNodes, maxDepth))
+    results = [connection.recv() for connection in self.connections]
+    self.nodes = sum(result[4] for result in results)
+    self.races = sum(result[5] for result in results)
+
+    deepest = max(result[2] for result in results)
+    finished = [result for result in results if result[2] == deepest]
+    votes = Counter(move for _,move,*_ in finished)
+    for evaluation, move, depth, line, *_ in finished:
+      if votes[move] == max(votes.values()):
+        return evaluation, move, depth, line
+
+  def close(self):
+    for connection in self.connections: connection.send(None)
+    for worker in self.workers: worker.join()
+    self.table.close()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Perft (Performance Test)
+
+Counts the leaf nodes of the move generation tree to a fixed depth. Node
+counts are compared against known counts of reference positions to check
+move generation, and the nodes per second measure its speed.
+"""
+
+from collections import namedtuple
+from time import time
+
+import chess.moves
+import chess.board
+
+PerftCounts = namedtuple('PerftCounts', ('nodes', 'captures', 'checks', 'mates'))
+
+Reference = namedtuple('Reference', ('name', 'fen', 'nodes'))
+
+# https://www.chessprogramming.org/Perft_Results. Node counts by depth.
+REFERENCE_POSITIONS = (
+  Reference('initial position',
+            'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            (20, 400, 8902, 197281)),
+  Reference('kiwipete',
+            'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+            (48, 2039, 97862)),
+  Reference('position 3',
+            '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+            (14, 191, 2812, 43238)),
+  Reference('position 4',
+            'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+            (6, 264, 9467)),
+  Reference('position 5',
+            'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+            (44, 1486, 62379)),
+  Reference('position 6',
+            'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+            (46, 2079, 89890)),
+  Reference('kings',
+            '4k3/8/8/8/8/8/8/4K3 w - - 0 1',
+            (5, 25, 170, 1156)),
+)
+
+def generate_moves(state, generator):
+  """Generated moves of the state, and the attack sets they were
+  generated with"""
+  attacks,attackSets = generator.find_attacks(state)
+  ordering = generator.find_moves(state, attacks, attackSets)
+  return [ordering.pop() for _ in range(len(ordering))], attackSets
+
+def is_in_check(state, color, attackSets):
+  king = state.pieceTypes[5] & state.colors[color]
+  return king & attackSets[not color] != 0
+
+def perft(state, depth, generator=None):
+  """Number of leaf nodes depth plies from the state
+
+  Bulk counting: the moves at the last ply are counted without being made.
+  """
+  if depth == 0: return 1
+  if generator is None: generator = chess.moves.Generator()
+
+  if depth == 1:
+    attacks,attackSets = generator.find_attacks(state)
+    return len(generator.find_moves(state, attacks, attackSets))
+
+  nodes = 0
+  for move in generate_moves(state, generator)[0]:
+    state += move
+    nodes += perft(state, depth-1, generator)
+    state -= move
+  return nodes
+
+def perft_counts(state, depth, generator=None):
+  """Leaf nodes, and how many leaves were reached by a capture, are in
+  check, or are checkmate
+
+  Leaves have to be made to find checks, so there is no bulk counting.
+  Checkmate means none of the generated moves gets the king out of check.
+  """
+  if generator is None: generator = chess.moves.Generator()
+
+  if depth == 0:
+    color = state.colorToMove
+    if not is_in_check(state, color, generator.find_attacks(state)[1]):
+      return PerftCounts(1,0,0,0)
+    for move in generate_moves(state, generator)[0]:
+      state += move
+      escaped = not is_in_check(state, color, generator.find_attacks(state)[1])
+      state -= move
+      if escaped: return PerftCounts(1,0,1,0)
+    return PerftCounts(1,0,1,1)
+
+  counts = PerftCounts(0,0,0,0)
+  for move in generate_moves(state, generator)[0]:
+    state += move
+    childCounts = perft_counts(state, depth-1, generator)
+    state -= move
+    if depth == 1 and chess.moves.is_capture(move):
+      childCounts = childCounts._replace(captures=1)
+    counts = PerftCounts(*map(sum, zip(counts, childCounts)))
+  return counts
+
+def divide(state, depth, generator=None):
+  """Perft of each root move, by move notation"""
+  if generator is None: generator = chess.moves.Generator()
+  nodesByMove = {}
+  for move in generate_moves(state, generator)[0]:
+    state += move
+    nodes = perft(state, depth-1, generator)
+    state -= move
+    nodesByMove[chess.moves.get_move_notation(move)] = nodes
+  return nodesByMove
+
+def run_reference_suite(maxDepth=3, output=print):
+  """Runs perft on each reference position up to the max depth
+
+  Prints the node counts, the expected counts and the nodes per second,
+  and returns the positions and depths whose count didn't match.
+  """
+  generator = chess.moves.Generator()
+  failures = []
+  for name,fen,expectedNodes in REFERENCE_POSITIONS:
+    state = chess.board.create_position(fen)
+    for depth,expected in enumerate(expectedNodes[:maxDepth], 1):
+      start = time()
+      nodes = perft(state, depth, generator)
+      elapsed = time() - start
+      result = 'ok' if nodes == expected else 'FAILED'
+      output(f'{name} depth {depth}: {nodes} nodes (expected {expected}) '
+             f'{nodes/max(elapsed, 1e-9):.0f} nps {result}')
+      if nodes != expected: failures.append((name, depth))
+  return failures
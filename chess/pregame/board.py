@@ -17,13 +17,8 @@ def Bitboard(*squares):
   return bits
 
 def reverse_bitboard(bitboard):
-  """Binary Reversal"""
-  reversedBits = 0
-  for _ in range(64):
-    reversedBits <<= 1
-    reversedBits |= bitboard & 1
-    bitboard >>= 1
-  return reversedBits
+  """Binary Reversal of the low 64 bits"""
+  return int(format(bitboard & 0xFFFFFFFFFFFFFFFF, '064b')[::-1], 2)
 
 def count_bits(bitboard):
   """Population Count"""
@@ -62,18 +57,12 @@ def generate_hash_table():
   """
   Precomputes all Zobrist Hash Table Values for quick lookup
 
-  Random bitstrings for  each piece element
+  A flat list of random bitstrings: one for each piece element, indexed by
+  (color*6 + piece type)*64 + square, then one for each castling right, one
+  for each en passant file and one for the side to move (781 in total)
   """
   from data.config.hash_key import RANDOM_ARRAY
-  hashes = {}
-  for square in range(64):
-    piece = Bitboard(square)
-    for pieceType in range(6):
-      for color in range(2):
-        colorMultiplier = 64 if color==0 else 64*2
-        tableIndex = colorMultiplier*(pieceType+1) + square - 64
-        hashes[(piece,pieceType,color)] = RANDOM_ARRAY[tableIndex]
-  return hashes
+  return list(RANDOM_ARRAY[:781])
 
 def setup_pieces():
   """"""
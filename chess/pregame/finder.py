@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Magic Number Finder
+
+Searches magic numbers for the bishop and rook fancy magic tables (see
+magic.py), checks them against subtract_blockers and stores the ones that
+make a smaller table in data/config/magics.json. The magic data file is
+generated from that file, and rebuilt once it changes. Options:
+
+  - fixed shift: every square uses the same shift, instead of one shift
+    per square from the number of bits in its attack mask
+  - reduced index bits: squares use fewer index bits than their attack
+    mask has bits. This only works with magics whose collisions are
+    constructive (blockers that share a key have the same attacks).
+  - shared table: the squares' parts of the table overlap wherever they
+    don't conflict (an entry is unused by one of them or they hold the same
+    attacks), like black magic layouts. Lookups stay the same, since every
+    square already has its own offset.
+
+python run.py magics [--piece bishop|rook] [--fixed-shift N] [--reduce-bits N]
+                     [--shared] [--tries N] [--seed N]
+"""
+
+import os
+import json
+import random
+import argparse
+import itertools
+import multiprocessing
+
+from chess.pregame.board import Bitboard, count_bits
+from chess.pregame.magic import (MAGIC_CONFIG_PATH, SLIDER_RAYS, InvalidMagicError,
+                                 generate_attack_masks, find_blocked_attacks,
+                                 get_magic_key, create_square_attacks,
+                                 create_magic_bitboard_table, load_magic_config)
+
+PIECES = ('bishop', 'rook')
+
+# number of random magics tried for a square and shift
+DEFAULT_TRIES = 100000
+
+def get_attack_mask(piece, square):
+  bishopAttackMasks,rookAttackMasks = generate_attack_masks()
+  attackMasks = bishopAttackMasks if piece == 'bishop' else rookAttackMasks
+  return attackMasks[Bitboard(square)]
+
+def find_magic(blockedAttacks, attackMask, shift, tries, rng):
+  """A magic that maps the blockers of each (blockers, attacks) pair to a key
+  without destructive collisions, or None after the given number of tries"""
+  size = 1 << (64-shift)
+  for _ in range(tries):
+    # sparse magics work best
+    magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+    if count_bits((attackMask * magic) & 0xFF00000000000000) < 4: continue
+
+    table = [0] * size
+    for blockers,attacks in blockedAttacks:
+      key = get_magic_key(blockers, magic, shift)
+      if table[key] == 0:
+        table[key] = attacks
+      elif table[key] != attacks:
+        break
+    else:
+      return magic
+  return None
+
+def find_square_magic(piece, square, fixedShift, reduceBits, tries, seed):
+  """Magic and shift of a square. Fewer index bits are tried first. The
+  configured magic is kept if no magic is found with fewer bits."""
+  attackMask = get_attack_mask(piece, square)
+  blockedAttacks = find_blocked_attacks(square, attackMask, SLIDER_RAYS[piece])
+  rng = random.Random(f'{seed} {piece} {square}')
+
+  if fixedShift is not None:
+    shifts = [fixedShift]
+  else:
+    indexBits = count_bits(attackMask)
+    shifts = [64 - bits for bits in range(indexBits - reduceBits, indexBits)]
+
+  for shift in shifts:
+    magic = find_magic(blockedAttacks, attackMask, shift, tries, rng)
+    if magic is not None: return magic, shift
+
+  # a magic without destructive collisions still has none with more bits
+  config = load_magic_config()[piece]
+  magic, shift = config['magics'][square], config['shifts'][square]
+  if fixedShift is not None and fixedShift <= shift: return magic, fixedShift
+  if fixedShift is None: return magic, shift
+  raise InvalidMagicError(f'no magic found for {piece} square {square}')
+
+def pack_table(squareAttacks):
+  """Offsets of a shared table: each square's part is placed at the first
+  offset where it doesn't conflict with the parts placed before it. Larger
+  parts are placed first."""
+  table, offsets = {}, [0]*64
+  order = sorted(range(64), key=lambda square: -len(squareAttacks[square]))
+  for square in order:
+    used = [(key, attacks) for key,attacks in enumerate(squareAttacks[square])
+            if attacks != 0]
+    for offset in itertools.count():
+      if all(table.get(offset+key, attacks) == attacks for key,attacks in used):
+        break
+    for key,attacks in used: table[offset+key] = attacks
+    offsets[square] = offset
+  return offsets
+
+def validate_magics(piece, magics, shifts, offsets=None):
+  """Builds the table of the magics, and checks every lookup against the
+  attacks calculated with subtract_blockers. Returns the table size."""
+  bishopAttackMasks,rookAttackMasks = generate_attack_masks()
+  attackMasks = bishopAttackMasks if piece == 'bishop' else rookAttackMasks
+  squareAttacks = [create_square_attacks(square, attackMasks[Bitboard(square)],
+                                         magics[square], shifts[square],
+                                         SLIDER_RAYS[piece])
+                   for square in range(64)]
+  table,offsets,*_ = create_magic_bitboard_table(
+    attackMasks, magics, shifts, squareAttacks, offsets)
+
+  for square in range(64):
+    attackMask = attackMasks[Bitboard(square)]
+    for blockers,attacks in find_blocked_attacks(square, attackMask,
+                                                 SLIDER_RAYS[piece]):
+      key = get_magic_key(blockers, magics[square], shifts[square])
+      if table[offsets[square] + key] != attacks:
+        raise InvalidMagicError(f'{piece} square {square} looks up wrong attacks')
+  return len(table)
+
+def find_magics(piece, fixedShift=None, reduceBits=0, shared=False,
+                tries=DEFAULT_TRIES, seed=0, pool=None):
+  """Magics, shifts and offsets (None unless the table is shared) by square"""
+  tasks = [(piece, square, fixedShift, reduceBits, tries, seed)
+           for square in range(64)]
+  starmap = pool.starmap if pool is not None else itertools.starmap
+  magics, shifts = zip(*starmap(find_square_magic, tasks))
+
+  offsets = None
+  if shared:
+    attackMasks = generate_attack_masks()[PIECES.index(piece)]
+    squareAttacks = [create_square_attacks(square, attackMasks[Bitboard(square)],
+                                           magics[square], shifts[square],
+                                           SLIDER_RAYS[piece])
+                     for square in range(64)]
+    offsets = pack_table(squareAttacks)
+  return {'magics': list(magics), 'shifts': list(shifts), 'offsets': offsets}
+
+def save_magics(piece, magics):
+  """Stores a piece's magics in data/config/magics.json"""
+  config = {}
+  if os.path.exists(MAGIC_CONFIG_PATH):
+    with open(MAGIC_CONFIG_PATH) as configFile:
+      config = json.load(configFile)
+  config[piece] = magics
+  with open(MAGIC_CONFIG_PATH, 'w') as configFile:
+    json.dump(config, configFile, indent=2)
+
+def run(args=()):
+  """Searches magics for each piece and stores the ones with a smaller
+  table than the current ones"""
+  parser = argparse.ArgumentParser(prog='run.py magics')
+  parser.add_argument('--piece', choices=PIECES, action='append')
+  parser.add_argument('--fixed-shift', type=int)
+  parser.add_argument('--reduce-bits', type=int, default=0)
+  parser.add_argument('--shared', action='store_true')
+  parser.add_argument('--tries', type=int, default=DEFAULT_TRIES)
+  parser.add_argument('--seed', type=int, default=0)
+  options = parser.parse_args(args)
+
+  with multiprocessing.Pool() as pool:
+    for piece in options.piece or PIECES:
+      current = load_magic_config()[piece]
+      currentSize = validate_magics(piece, current['magics'], current['shifts'],
+                                    current['offsets'])
+      found = find_magics(piece, options.fixed_shift, options.reduce_bits,
+                          options.shared, options.tries, options.seed, pool)
+      size = validate_magics(piece, found['magics'], found['shifts'],
+                             found['offsets'])
+      print(f'{piece}: {size} table entries (currently {currentSize})')
+      if size < currentSize:
+        save_magics(piece, found)
+        print(f'{piece} magics saved to {MAGIC_CONFIG_PATH}')
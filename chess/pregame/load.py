@@ -2,61 +2,187 @@
 """Loads Stored Engine Data"""
 
 import os
+import sys
 
 import json
-import pickle
+import mmap
+import functools
+from array import array
 from collections import namedtuple
 
-from chess.pregame.save import DATA_DIRECTORY, DATA_FILES
+from chess.pregame.save import DATA_DIRECTORY, DATA_FILES, InvalidDataFileError
+from chess.pregame.save import read_data_file
+from chess.pregame.save import BINARY_FORMAT_TAG, BINARY_FORMAT_VERSION
+from chess.pregame.save import BINARY_TABLES
 
 isDigit = lambda k: k.lstrip('-').isdigit()
 parseJson = lambda d: {int(k) if isDigit(k) else k:v for k,v in d.items()}
 
+# Process-wide registry of loaded data, keyed by loader and arguments. Data
+# files are read and tables are built the first time they are loaded. After
+# that, every State, PieceSet, Generator and Evaluator shares the same
+# objects, so the loaded tables must not be modified.
+registry = {}
+
+def registered(loader):
+  """Loads the data once per process, then returns it from the registry"""
+  @functools.wraps(loader)
+  def load(*args, **kwargs):
+    key = (loader.__name__, args, tuple(sorted(kwargs.items())))
+    if key not in registry: registry[key] = loader(*args, **kwargs)
+    return registry[key]
+  return load
+
+def clear_registry():
+  """Forgets loaded data, e.g. after data files were regenerated"""
+  registry.clear()
+
+@registered
 def load_data_file(fileName):
-  """Loads json and pickle data files"""
+  """Loads json and pickle data files. Pickle files start with a header
+  (see save.py), which is skipped."""
   fileType = os.path.splitext(fileName)[1]
-  fileMode = 'r' if fileType == '.json' else 'rb'
+  if fileType == '.pickle': return read_data_file(fileName)
   path = os.path.join(DATA_DIRECTORY, fileName)
-  with open(path, fileMode) as dataFile:
-    load = pickle.load if fileType == '.pickle' else json.load
-    fileContents = load(dataFile)
+  with open(path, 'r') as dataFile:
+    fileContents = json.load(dataFile)
   return fileContents
 
-def create_mask_set(maskSetName, maskTypes):
+@registered
+def load_binary_tables():
+  """Tables of the binary tables file (see save.py) by name, or None if the
+  file doesn't exist
+
+  The file is memory-mapped and the tables are zero-copy views of it, so
+  processes using the same file share its pages. The views index like
+  lists of ints, and can't be pickled.
+  """
+  path = os.path.join(DATA_DIRECTORY, DATA_FILES.tables)
+  if not os.path.exists(path): return None
+  with open(path, 'rb') as dataFile:
+    mapped = mmap.mmap(dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+  words = memoryview(mapped).cast('Q')
+  if sys.byteorder == 'big': # the file is little endian
+    words = array('Q', words)
+    words.byteswap()
+    words = memoryview(words)
+
+  tag, version, _, numTables = words[:4]
+  if tag != BINARY_FORMAT_TAG or version != BINARY_FORMAT_VERSION \
+      or numTables != len(BINARY_TABLES):
+    raise InvalidDataFileError(f'{DATA_FILES.tables} has an unknown format')
+
+  start = 4 + 2*numTables
+  tables = {}
+  for index,name in enumerate(BINARY_TABLES):
+    offset, length = words[4+2*index], words[5+2*index]
+    tables[name] = words[start+offset:start+offset+length]
+  return tables
+
+def split_table(table, rowLength):
+  """Views of the consecutive rows of a flat table"""
+  return [table[row:row+rowLength] for row in range(0, len(table), rowLength)]
+
+def index_by_square(table):
+  """64 entry list, indexed by square, of a table keyed by square bitboards"""
+  return [table[1 << (63-square)] for square in range(64)]
+
+def index_by_squares(table):
+  """Square indexed list of square indexed lists, of a table keyed by two
+  square bitboards"""
+  return [index_by_square(row) for row in index_by_square(table)]
+
+def create_mask_set(maskSetName, maskTypes, bySquare=False):
   MaskSet = namedtuple(maskSetName + 'Masks', maskTypes)
-  masks = load_data_file(DATA_FILES.masks)
+  tables = load_binary_tables() if bySquare else None
+  if tables is not None and all(mask in tables for mask in maskTypes):
+    return MaskSet(*[split_table(tables[mask], 64)
+                     if mask in ('pawnBlockers', 'between', 'lines')
+                     else tables[mask] for mask in maskTypes])
+  masks = dict(load_data_file(DATA_FILES.masks)) # shared, so copied
+  if bySquare:
+    for mask in maskTypes:
+      if mask in ('between', 'lines'):
+        masks[mask] = index_by_squares(masks[mask])
+      elif mask == 'pawnBlockers':
+        masks[mask] = [index_by_square(colorMasks) for colorMasks in masks[mask]]
+      elif isinstance(masks[mask], dict):
+        masks[mask] = index_by_square(masks[mask])
   return MaskSet(*[masks[mask] for mask in maskTypes])
 
-def load_move_masks():
+@registered
+def load_move_masks(bySquare=False):
+  """Move masks, keyed by square bitboards or indexed by square"""
   maskTypes = ('ranks','files','diagonals','antidiagonals',
                'reversedRanks','reversedFiles','reversedDiagonals',
-               'reversedAntidiagonals', 'reversedSquares', 'pawnBlockers')
-  return create_mask_set('Move', maskTypes)
+               'reversedAntidiagonals', 'reversedSquares', 'pawnBlockers',
+               'between', 'lines')
+  return create_mask_set('Move', maskTypes, bySquare)
 
-def load_move_cache():
+@registered
+def load_move_cache(bySquare=False):
+  """Move lists and move sets of each piece type, keyed by square
+  bitboards or indexed by square. Pawn tables are split by color."""
   moveFileData = load_data_file(DATA_FILES.moves)
-  return moveFileData['moves'], moveFileData['move sets']
+  moves, movesets = moveFileData['moves'], moveFileData['move sets']
+  if bySquare:
+    moves, movesets = [
+      [list(map(index_by_square, table)) if pieceType == 0
+       else index_by_square(table) for pieceType,table in enumerate(tables)]
+      for tables in (moves, movesets)]
+  return moves, movesets
+
+@registered
+def load_move_sets():
+  """Move sets of each piece type, indexed by square. Pawn move sets are
+  (pushes, attacks) pairs, split by color."""
+  tables = load_binary_tables()
+  if tables is None: return load_move_cache(bySquare=True)[1]
+  pawnMoveSets = split_table(tables['pawn move sets'], 2)
+  return [[pawnMoveSets[:64], pawnMoveSets[64:]]] + [
+    tables[f'{piece} move sets']
+    for piece in ('knight', 'bishop', 'rook', 'queen', 'king')]
 
+@registered
 def load_magic():
+  """Bishop and rook fancy magic tables. Everything but the flat attack
+  list is indexed by square (see chess/pregame/magic.py)"""
+  MagicTable = namedtuple('MagicTable', 'attacks offsets masks magics shifts')
+  parts = MagicTable._fields
+  tables = load_binary_tables()
+  if tables is not None:
+    return [MagicTable(*[tables[f'{piece} {part}'] for part in parts])
+            for piece in ['bishop', 'rook']]
   magicData = load_data_file(DATA_FILES.magic)
-  MagicCache = namedtuple('MagicCache', 'cache bitboards attacks indecies')
-  return [MagicCache(*magicData[piece]) for piece in ['bishop', 'rook']]
+  return [MagicTable(*magicData[piece]) for piece in ['bishop', 'rook']]
 
+@registered
 def load_evaluation_masks():
   maskTypes = ('centerSquares', 'centerFiles', 'minorPieceSquares')
   return create_mask_set('Evaluation', maskTypes)
 
-def load_piece_square_tables():
-  return load_data_file(DATA_FILES.board)['pst']
+@registered
+def load_piece_square_tables(bySquare=False):
+  """Piece square tables by color and piece type"""
+  tables = load_data_file(DATA_FILES.board)['pst']
+  if bySquare:
+    tables = [list(map(index_by_square, colorTables)) for colorTables in tables]
+  return tables
 
+@registered
 def load_initial_pieces():
   return load_data_file(DATA_FILES.board)['initial pieces']
 
+@registered
 def load_piece_index_values():
   indexerTypes = ['num pieces', 'piece type lookup',
                   'piece color lookup', 'color ranges']
   indexers = load_data_file(DATA_FILES.board)['piece index values']
-  return (indexers[label] for label in indexerTypes)
+  return tuple(indexers[label] for label in indexerTypes)
 
+@registered
 def load_hash_values():
+  """Flat Zobrist table (see generate_hash_table)"""
+  tables = load_binary_tables()
+  if tables is not None: return tables['hash values']
   return load_data_file(DATA_FILES.board)['hash values']
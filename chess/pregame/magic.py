@@ -1,6 +1,22 @@
+import os
+import json
+import itertools
+
+from settings import DATA_DIRECTORY
 from chess.pregame.board import *
 from chess.pregame.moves import get_rays, N, NE, E, SE, S, SW, W, NW
 
+class InvalidMagicError(Exception): pass
+
+# Magics found by chess/pregame/finder.py, which replace the ones below
+MAGIC_CONFIG_PATH = os.path.join(DATA_DIRECTORY, 'config', 'magics.json')
+
+# pairs of opposite ray directions of each slider
+SLIDER_RAYS = {'bishop': ((NE,SW), (SE,NW)), 'rook': ((E,W), (N,S))}
+
+# Magic numbers and index bits are listed by bit index (a1 is bit 0). The
+# bitboard of square s is at bit 63-s (see board.py), so they are looked
+# up with 63-s.
 ROOK_MAGICS = [
     0xa8002c000108020,0x6c00049b0002001,0x100200010090040,0x2480041000800801,
     0x280028004000800,0x900410008040022,0x280020001001080,0x2880002041000080,
@@ -122,80 +138,113 @@ def subtract_blockers(slider, occupied, mask):
   # combine positive and negative rays into one Bitboard
   return positiveRay | negativeRay
 
-def create_magic_bitboard_tables():
-    bishopAttacks, rookAttacks = generate_attack_masks()
-
-    rookTable,bishopTable = {},{}
-
-    def generate_blockers(numIndecies, attackMask):
-        attackSquares = get_squares_from_bitboard(attackMask)
-        for blockerIndex in range(1 << numIndecies):
-            blockers = 0
-            for i in range(len(attackSquares)):
-                if blockerIndex & (1 << i):
-                    blockers |= Bitboard(attackSquares[i])
-                # if blockerIndex & (1 << i):
-                #     blockers |= (1 << attackSquares[i])
-            yield blockers
-
-    for square in range(64):
-        squareMask = Bitboard(square)
-        # BISHOP
-        bishopTable[squareMask] = {}
-        numBishopIndecies = BISHOP_INDEX_BITS[square]
-        bishopMagic = BISHOP_MAGICS[square]
-        for blockerMask in generate_blockers(numBishopIndecies,
-                                             bishopAttacks[squareMask]):
-            diagonal = create_ray_mask(square, NE, SW)
-            antidiagonal = create_ray_mask(square, SE, NW)
-
-            attacks = subtract_blockers(squareMask, blockerMask, diagonal) \
-                    | subtract_blockers(squareMask, blockerMask, antidiagonal)
-
-
-            bishopKey = (blockerMask * bishopMagic) >> (64 - numBishopIndecies)
-
-            bishopTable[squareMask][bishopKey] = attacks
-
-        # ROOK
-        rookTable[squareMask] = {}
-        numRookIndecies = ROOK_INDEX_BITS[square]
-        for blockerMask in generate_blockers(numRookIndecies,
-                                             rookAttacks[squareMask]):
-
-            rank = create_ray_mask(square, E, W)
-            file = create_ray_mask(square, N, S)
-
-            attacks = subtract_blockers(squareMask, blockerMask, rank) \
-                    | subtract_blockers(squareMask, blockerMask, file)
-
-            rookMagic = ROOK_MAGICS[square]
-            rookKey = (blockerMask * rookMagic) >> (64 - numRookIndecies)
-
-            rookTable[squareMask][rookKey] = attacks
-
-
-    return bishopTable, rookTable
-
-
-def generate_magic_bitboard_cache():
-    bishopMagicBitboards,rookMagicBitboards = {},{}
-    bishopIndexBits,rookIndexBits = {},{}
+def get_magic_key(blockers, magic, shift):
+    """Index of the blockers' attacks in a square's part of the table.
+    The multiplication wraps around at 64 bits."""
+    return ((blockers * magic) & 0xFFFFFFFFFFFFFFFF) >> shift
+
+def generate_blockers(attackMask):
+    """Every subset of the attack mask"""
+    blockers = 0
+    while True:
+        yield blockers
+        blockers = (blockers - attackMask) & attackMask
+        if blockers == 0: break
+
+def find_blocked_attacks(square, attackMask, rays):
+    """(blockers, attacks) for every subset of blockers of the attack mask,
+    calculated with subtract_blockers"""
+    squareMask = Bitboard(square)
+    rayMasks = [create_ray_mask(square, *directions) for directions in rays]
+    blockedAttacks = []
+    for blockers in generate_blockers(attackMask):
+        attacks = 0
+        for rayMask in rayMasks:
+            attacks |= subtract_blockers(squareMask, blockers, rayMask)
+        blockedAttacks.append((blockers, attacks))
+    return blockedAttacks
+
+def create_square_attacks(square, attackMask, magic, shift, rays):
+    """A square's part of a fancy magic table: the attacks of every subset
+    of blockers, at their magic key. Unused keys are 0, which is never the
+    attacks of a slider."""
+    attacks = [0] * (1 << (64-shift))
+    for blockers,blockedAttacks in find_blocked_attacks(square, attackMask, rays):
+        key = get_magic_key(blockers, magic, shift)
+        if attacks[key] not in (0, blockedAttacks):
+            raise InvalidMagicError(f'magic {magic:#x} of square {square} collides')
+        attacks[key] = blockedAttacks
+    return attacks
+
+def create_magic_bitboard_table(attackMasks, magics, shifts, squareAttacks,
+                                offsets=None):
+    """Fancy Magic Bitboards
+
+    The attacks of every square are stored in one flat list. Each square
+    owns 2^(64-shift) consecutive entries starting at its offset, and its
+    magic key indexes into them. Everything is indexed by square. Without
+    offsets, the squares' parts follow each other. Given offsets, the
+    parts can overlap (a shared table), as long as overlapping entries are
+    unused by one of the squares or hold the same attacks.
+    """
+    if offsets is None:
+        offsets = [0]
+        for attacks in squareAttacks[:-1]:
+            offsets.append(offsets[-1] + len(attacks))
+
+    size = max(offset + len(attacks)
+               for offset,attacks in zip(offsets, squareAttacks))
+    table = [0] * size
     for square in range(64):
-        squareMask = Bitboard(square)
-
-        bishopMagicBitboards[squareMask] = BISHOP_MAGICS[square]
-        rookMagicBitboards[squareMask] = ROOK_MAGICS[square]
-
-        bishopIndexBits[squareMask] = BISHOP_INDEX_BITS[square]
-        rookIndexBits[squareMask] = ROOK_INDEX_BITS[square]
-
+        offset = offsets[square]
+        for key,attacks in enumerate(squareAttacks[square]):
+            if attacks == 0: continue
+            if table[offset+key] not in (0, attacks):
+                raise InvalidMagicError(f'table part of square {square} overlaps')
+            table[offset+key] = attacks
+
+    masks = [attackMasks[Bitboard(square)] for square in range(64)]
+    return table, list(offsets), masks, list(magics), list(shifts)
+
+def load_magic_config():
+    """Magics, shifts and table offsets (or None) by square, for the
+    bishop and the rook. Magics found with chess/pregame/finder.py are
+    stored in data/config/magics.json and replace the hard-coded ones."""
+    # hard-coded magics and index bits are listed by bit index (see above)
+    config = {
+        'bishop': {
+            'magics': [BISHOP_MAGICS[63-square] for square in range(64)],
+            'shifts': [64-BISHOP_INDEX_BITS[63-square] for square in range(64)],
+            'offsets': None,
+        },
+        'rook': {
+            'magics': [ROOK_MAGICS[63-square] for square in range(64)],
+            'shifts': [64-ROOK_INDEX_BITS[63-square] for square in range(64)],
+            'offsets': None,
+        },
+    }
+    if os.path.exists(MAGIC_CONFIG_PATH):
+        with open(MAGIC_CONFIG_PATH) as configFile:
+            config.update(json.load(configFile))
+    return config
+
+def generate_magic_bitboard_cache(pool=None):
+    """Bishop and rook magic tables. The squares of both pieces are
+    generated on the process pool if one is given."""
+    config = load_magic_config()
     bishopAttackMasks,rookAttackMasks = generate_attack_masks()
-    bishopTable,rookTable = create_magic_bitboard_tables()
+    attackMasks = {'bishop': bishopAttackMasks, 'rook': rookAttackMasks}
+
+    tasks = [(square, attackMasks[piece][Bitboard(square)],
+              config[piece]['magics'][square], config[piece]['shifts'][square],
+              SLIDER_RAYS[piece])
+             for piece in ('bishop', 'rook') for square in range(64)]
+    starmap = pool.starmap if pool is not None else itertools.starmap
+    squareAttacks = list(starmap(create_square_attacks, tasks))
 
     return {
-        'bishop': (bishopTable, bishopMagicBitboards,
-                   bishopAttackMasks, bishopIndexBits),
-        'rook': (rookTable, rookMagicBitboards,
-                 rookAttackMasks, rookIndexBits)
+        piece: create_magic_bitboard_table(
+            attackMasks[piece], config[piece]['magics'], config[piece]['shifts'],
+            squareAttacks[64*index:64*(index+1)], config[piece]['offsets'])
+        for index,piece in enumerate(('bishop', 'rook'))
     }
@@ -189,15 +189,65 @@ def generate_castle_masks():
 
   return { 'queenside': castleMasks[0:2], 'kingside': castleMasks[2:4] }
 
+def generate_between_and_line_masks():
+  """Masks of the squares between two squares, and of the line through them
+
+  Both are keyed by the two square bitboards: masks[a][b]. Squares that
+  don't share a rank, file, diagonal or antidiagonal have empty masks.
+  Between masks don't include the two squares themselves. Line masks run
+  from edge to edge and do.
+
+    Between e1,a5           Line e1,a5
+
+    00000000                00000000
+    00000000                00000000
+    00000000                00000000
+    00000000                10000000
+    01000000                01000000
+    00100000                00100000
+    00010000                00010000
+    00000000                00001000
+  """
+  directions = [(0,1),(1,0),(1,1),(1,-1)]
+  between,lines = {},{}
+  for square in range(64):
+    squareBitboard = Bitboard(square)
+    between[squareBitboard],lines[squareBitboard] = {},{}
+    x,y = get_coordinate(square)
+    for otherSquare in range(64):
+      otherBitboard = Bitboard(otherSquare)
+      between[squareBitboard][otherBitboard] = 0
+      lines[squareBitboard][otherBitboard] = 0
+
+    for dx,dy in directions:
+      # every square of the line through the square, ordered from one
+      # edge to the other
+      line = [(x+dx*step, y+dy*step) for step in range(-7,8)
+              if 0 <= x+dx*step < 8 and 0 <= y+dy*step < 8]
+      lineMask = Bitboard(*[get_square(*coordinate) for coordinate in line])
+      index = line.index((x,y))
+      for otherIndex,coordinate in enumerate(line):
+        if otherIndex == index: continue
+        otherBitboard = Bitboard(get_square(*coordinate))
+        low,high = sorted((index, otherIndex))
+        betweenSquares = [get_square(*c) for c in line[low+1:high]]
+        between[squareBitboard][otherBitboard] = Bitboard(*betweenSquares)
+        lines[squareBitboard][otherBitboard] = lineMask
+
+  return between,lines
+
 def create_king_attack_zone_masks():
   pass
   
 def generate_masks():
+  between,lines = generate_between_and_line_masks()
   return {
     **generate_ray_masks(),
     **generate_ray_masks(reverse=True),
     'reversedSquares':   generate_reversed_square_masks(),
     'pawnBlockers':      generate_pawn_blocker_masks(),
+    'between':           between,
+    'lines':             lines,
     'centerSquares':     generate_center_square_masks(),
     'centerFiles':       generate_center_file_masks(),
     'castleSquares':     generate_castle_masks(),
@@ -59,9 +59,9 @@ def SE(x,y,d=1): return x+d,y-d
 def SW(x,y,d=1): return x-d,y-d
 def NW(x,y,d=1): return x-d,y+d
 
-def get_rays(x,y, directions, numSteps=8):
+def get_rays(x,y, directions, numSteps=7):
   makeNSteps = lambda n: [d(x,y,n) for d in directions]
-  rays = map(makeNSteps, range(1,numSteps))
+  rays = map(makeNSteps, range(1,numSteps+1))
   return sum(rays,[])
 
 def get_move_finder(pieceType):
@@ -79,7 +79,7 @@ def get_move_finder(pieceType):
     forward = -1 if color==WHITE else 1
     onStartRank = y == {WHITE: 6, BLACK: 1}[color]
     numSteps = 2 if onStartRank else 1
-    moves = [(x, y+step*forward) for step in range(numSteps)]
+    moves = [(x, y+step*forward) for step in range(1,numSteps+1)]
     attacks = [(x+1, y+forward), (x-1, y+forward)]
     return get_valid_squares(moves), get_valid_squares(attacks)
 
@@ -2,32 +2,150 @@
 """Engine Data File Management"""
 
 import os
-import json
+import sys
 import pickle
+import hashlib
+import multiprocessing
+from array import array
 from collections import namedtuple
 
+import settings
 from settings import DATA_DIRECTORY
 
+from chess.pregame import magic
 from chess.pregame.board import generate_board_data
 from chess.pregame.masks import generate_masks
 from chess.pregame.moves import generate_move_cache
 from chess.pregame.magic import generate_magic_bitboard_cache
 
 
-DataFiles = namedtuple('DataFiles', ('board', 'moves', 'masks', 'magic'))
-DATA_FILES = DataFiles('board.pickle','moves.pickle','masks.pickle',' magic.pickle')
+DataFiles = namedtuple('DataFiles', ('board', 'moves', 'masks', 'magic', 'tables'))
+DATA_FILES = DataFiles('board.pickle','moves.pickle','masks.pickle',' magic.pickle',
+                       'tables.bin')
+
+# Binary tables file: the magic, move set, move mask and Zobrist tables,
+# indexed by square and flattened into little endian unsigned 64 bit words,
+# so that it can be memory-mapped instead of unpickled. The header is the
+# format tag, the format version, the inputs hash (see get_inputs_hash) and
+# the number of tables, then the offset
+# (in words, after the header) and length of each table, in the order of
+# BINARY_TABLES.
+BINARY_FORMAT_TAG = int.from_bytes(b'pcetbls\0', 'little')
+BINARY_FORMAT_VERSION = 2
+BINARY_MOVE_MASKS = ('ranks', 'files', 'diagonals', 'antidiagonals',
+                     'reversedRanks', 'reversedFiles', 'reversedDiagonals',
+                     'reversedAntidiagonals', 'reversedSquares')
+BINARY_TABLES = (
+    *(f'{piece} {part}' for piece in ('bishop', 'rook')
+      for part in ('attacks', 'offsets', 'masks', 'magics', 'shifts')),
+    *(f'{piece} move sets' for piece in
+      ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')),
+    *BINARY_MOVE_MASKS, 'pawnBlockers', 'between', 'lines',
+    'hash values',
+)
+
+# Bumped when the contents of a data file change without its inputs
+# changing (e.g. a generator fix), so that existing files get rebuilt
+DATA_FORMAT_VERSION = 2
 
 class InvalidDataFileError(Exception): pass
 class MissingConfigFileError(Exception): pass
 
-def generate_data_file(fileName):
-    path = os.path.join(DATA_DIRECTORY,fileName)
+def read_config_file(fileName):
+    with open(os.path.join(DATA_DIRECTORY, 'config', fileName), 'rb') as f:
+        return f.read()
+
+def get_inputs_hash(fileName):
+    """64 bit hash of everything a data file is generated from. A file whose
+    header holds a different hash is out of date."""
+    if fileName == DATA_FILES.board:
+        inputs = (settings.INITIAL_POSITION, read_config_file('pst.json'),
+                  read_config_file('hash_key.py'))
+    elif fileName == DATA_FILES.magic:
+        inputs = (magic.load_magic_config(),)
+    elif fileName == DATA_FILES.tables:
+        inputs = (BINARY_FORMAT_VERSION, *map(get_inputs_hash, DATA_FILES[:4]))
+    else:
+        inputs = ()
+    digest = hashlib.sha256(repr((DATA_FORMAT_VERSION, fileName, inputs)).encode())
+    return int.from_bytes(digest.digest()[:8], 'little')
+
+def read_inputs_hash(fileName):
+    """The inputs hash in a data file's header, or None if the file doesn't
+    exist or has no header"""
+    path = os.path.join(DATA_DIRECTORY, fileName)
+    try:
+        with open(path, 'rb') as dataFile:
+            if os.path.splitext(fileName)[1] == '.bin':
+                header = array('Q', dataFile.read(24))
+                if sys.byteorder == 'big': header.byteswap()
+                if header[0] != BINARY_FORMAT_TAG: return None
+                return header[2] if header[1] == BINARY_FORMAT_VERSION else None
+            header = pickle.load(dataFile)
+            return header.get('inputs') if isinstance(header, dict) else None
+    except (OSError, EOFError, ValueError, IndexError, pickle.UnpicklingError):
+        return None
+
+def data_file_is_current(fileName):
+    return read_inputs_hash(fileName) == get_inputs_hash(fileName)
+
+def read_data_file(fileName):
+    """Data of a pickle data file, after its header"""
+    with open(os.path.join(DATA_DIRECTORY, fileName), 'rb') as dataFile:
+        pickle.load(dataFile) # header
+        return pickle.load(dataFile)
+
+def generate_binary_tables():
+    """Flattens the tables of the other data files for the binary tables
+    file. Returns a list of words for each table, by table name"""
+    bySquare = lambda table: [table[1 << (63-square)] for square in range(64)]
+    flatten = lambda rows: [word for row in rows for word in row]
 
-    # If file already exists, prompt user if it should be deleted/regenerated
-    if os.path.exists(path):
-        prompt = f'{fileName} already exists. Delete and regenerate? (y/n)'
-        if input(prompt) != 'y': return # Exit Generation
-        os.remove(path) # delete file and regenerate
+    magicData = read_data_file(DATA_FILES.magic)
+    moveSets = read_data_file(DATA_FILES.moves)['move sets']
+    masks = read_data_file(DATA_FILES.masks)
+    hashValues = read_data_file(DATA_FILES.board)['hash values']
+
+    tables = {}
+    for piece in ('bishop', 'rook'):
+        parts = ('attacks', 'offsets', 'masks', 'magics', 'shifts')
+        for part,table in zip(parts, magicData[piece]):
+            tables[f'{piece} {part}'] = list(table)
+
+    # pawn move sets are a (pushes, attacks) pair by color and square
+    tables['pawn move sets'] = flatten(
+        flatten(bySquare(colorMoveSets)) for colorMoveSets in moveSets[0])
+    pieces = ('knight', 'bishop', 'rook', 'queen', 'king')
+    for pieceType,piece in enumerate(pieces, 1):
+        tables[f'{piece} move sets'] = bySquare(moveSets[pieceType])
+
+    for mask in BINARY_MOVE_MASKS:
+        tables[mask] = bySquare(masks[mask])
+    tables['pawnBlockers'] = flatten(map(bySquare, masks['pawnBlockers']))
+    for mask in ('between', 'lines'):
+        tables[mask] = flatten(map(bySquare, bySquare(masks[mask])))
+
+    tables['hash values'] = hashValues
+    return tables
+
+def write_binary_tables(path, tables):
+    """Writes the tables (lists of words by name) in the binary format"""
+    header = [BINARY_FORMAT_TAG, BINARY_FORMAT_VERSION,
+              get_inputs_hash(DATA_FILES.tables), len(BINARY_TABLES)]
+    words, offset = array('Q'), 0
+    for name in BINARY_TABLES:
+        header += [offset, len(tables[name])]
+        words.extend(tables[name])
+        offset += len(tables[name])
+    words = array('Q', header) + words
+    if sys.byteorder == 'big': words.byteswap()
+    with open(path, 'wb') as dataFile:
+        words.tofile(dataFile)
+
+def generate_data_file(fileName, pool=None):
+    """Generates a data file, replacing an existing one. The magic tables are
+    built on the process pool if one is given."""
+    path = os.path.join(DATA_DIRECTORY,fileName)
 
     # generate the data
     if fileName == DATA_FILES.moves:
@@ -37,27 +155,37 @@ def generate_data_file(fileName):
     elif fileName == DATA_FILES.board:
         data = generate_board_data()
     elif fileName == DATA_FILES.magic:
-        data = generate_magic_bitboard_cache()
+        data = generate_magic_bitboard_cache(pool)
+    elif fileName == DATA_FILES.tables:
+        data = generate_binary_tables()
     else:
         raise InvalidDataFileError(f'Unknown data file {fileName}')
 
-    # save the data to file. File is either a json or pickle file
-    fileType = os.path.splitext(fileName)[1]
-    fileMode = 'w' if fileType == '.json' else 'wb'
-    with open(path, fileMode) as dataFile:
-        file_lib = json if fileType == '.json' else pickle
-        file_lib.dump(data, dataFile)
+    # save the data to a temporary file, which then replaces the data file
+    # at once, so no process ever reads a partly written file. Pickle files
+    # start with a header holding the inputs hash.
+    temporaryPath = f'{path}.{os.getpid()}.tmp'
+    if os.path.splitext(fileName)[1] == '.bin':
+        write_binary_tables(temporaryPath, data)
+    else:
+        with open(temporaryPath, 'wb') as dataFile:
+            pickle.dump({'inputs': get_inputs_hash(fileName)}, dataFile)
+            pickle.dump(data, dataFile)
+    os.replace(temporaryPath, path)
 
     print(f'pregame data file \'{fileName}\' created')
 
 def data_is_generated():
-    for fileName in DATA_FILES:
-        path = os.path.join(DATA_DIRECTORY, fileName)
-        if os.path.exists(path): return False
-    return True
+    return all(map(data_file_is_current, DATA_FILES))
 
 def generate_missing_data_files():
-    for fileName in DATA_FILES:
-        path = os.path.join(DATA_DIRECTORY, fileName)
-        if os.path.exists(path): continue
-        generate_data_file(fileName)
+    """Generates the data files that don't exist or are out of date. Files
+    are generated in DATA_FILES order, since the binary tables are built
+    from the other files."""
+    staleFiles = [fileName for fileName in DATA_FILES
+                  if not data_file_is_current(fileName)]
+    if DATA_FILES.magic in staleFiles:
+        with multiprocessing.Pool() as pool:
+            for fileName in staleFiles: generate_data_file(fileName, pool)
+    else:
+        for fileName in staleFiles: generate_data_file(fileName)
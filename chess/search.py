@@ -2,20 +2,182 @@
 """Game Tree Search"""
 
 from time import time
+from math import log
 
 import settings
 import chess.moves
 import chess.board
+from chess.transposition import TranspositionTable, open_shared_table
+from chess.transposition import EXACT, LOWER, UPPER
+from chess.stats import SearchStats
 
-from debug import SearchMonitor
-
-monitor = SearchMonitor() # Debug Tool
-# builder = TreeBuilder()   # Debug Tool
+# search instrumentation (see chess/stats.py). None when switched off.
+stats = SearchStats() if settings.SEARCH_STATS else None
 
 MAX_VALUE = 1000
 
-def explore_leaves(state, evaluator, generator, maximize,
-                   alpha, beta, depth, maxDepth, maxValue, isQuiet=True):
+# Null window width for principal variation search, and the initial
+# aspiration window around the previous iteration's evaluation.
+NULL_WINDOW = 0.0001
+ASPIRATION_WINDOW = 0.5
+
+# Delta pruning safety margin in pawns. Captures that can't raise the
+# stand pat score to alpha even with this bonus are not searched.
+DELTA_MARGIN = 2
+
+# Selective search parameters (see settings.py to switch them on/off).
+# Null moves are searched R plies shallower, and verified by a reduced
+# search when the side to move has few pieces besides pawns. Late moves
+# are reduced after the first few moves when there is enough depth left.
+# Futility margins are in pawns per remaining ply.
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_VERIFICATION_PIECES = 2
+LATE_MOVE_MIN_DEPTH = 3
+LATE_MOVE_MIN_INDEX = 3
+FUTILITY_MARGIN = 2
+REVERSE_FUTILITY_DEPTH = 2
+
+class SearchTimeout(Exception): pass
+
+class SearchLimits:
+  """Per Move Search Budget
+
+  Wall clock time in seconds and number of nodes searched. Either limit
+  can be None, in which case it is unbounded. Once a limit is exceeded, or
+  the search is stopped from another thread, the next searched node raises
+  a SearchTimeout.
+  """
+
+  def __init__(self, maxTime=None, maxNodes=None):
+    self.maxTime = maxTime
+    self.maxNodes = maxNodes
+    self.start = time()
+    self.deadline = None if maxTime is None else self.start + maxTime
+    self.nodes = 0
+    self.stopped = False
+
+  def stop(self):
+    self.stopped = True
+
+  def set_time(self, maxTime):
+    """Starts a time budget from now, e.g. when pondering turns into a
+    normal search"""
+    self.maxTime = self.elapsed() + maxTime
+    self.deadline = time() + maxTime
+
+  def node_searched(self):
+    self.nodes += 1
+    if self.stopped:
+      raise SearchTimeout('search stopped')
+    if self.maxNodes is not None and self.nodes > self.maxNodes:
+      raise SearchTimeout('node budget exceeded')
+    if self.deadline is not None and time() >= self.deadline:
+      raise SearchTimeout('time budget exceeded')
+
+  def elapsed(self):
+    return time() - self.start
+
+  def allows_next_iteration(self):
+    """An iteration takes longer than all previous ones combined, so
+    there is no point starting one with less than half the time left."""
+    if self.stopped: return False
+    return self.maxTime is None or self.elapsed() * 2 < self.maxTime
+
+def quiesce(state, evaluator, generator, maximize, alpha, beta, depth,
+            limits=None):
+  """Quiescence Search
+
+  Searches captures only, until the position is quiet, so that leaves
+  aren't evaluated in the middle of an exchange. The side to move can
+  always decline to capture, so the static evaluation (stand pat) is a
+  bound on the node's value and can cause a cutoff on its own. Captures
+  are ordered with MVV-LVA. Captures that lose material by static exchange
+  evaluation are ordered last and not searched, and captures whose victim
+  can't make up the difference to alpha/beta are skipped (delta pruning).
+  """
+  if stats is not None: stats.quiescence_node_searched()
+  if limits is not None: limits.node_searched()
+
+  attacks,attackSets = generator.find_attacks(state)
+  standPat = evaluator(state, attacks)
+
+  if maximize:
+    if standPat >= beta: return standPat
+    alpha = max(alpha, standPat)
+  else:
+    if standPat <= alpha: return standPat
+    beta = min(beta, standPat)
+
+  margin = evaluator.capture_value(0) * DELTA_MARGIN
+  best = standPat
+  captures = generator.find_captures(state, attacks, attackSets)
+  while beta > alpha and len(captures) > 0 \
+      and captures.next_priority() < chess.moves.BAD_CAPTURE_PRIORITY:
+    move = captures.pop()
+
+    # delta pruning
+    gain = evaluator.capture_value(chess.moves.get_capture_type(move)) + margin
+    if maximize and standPat + gain <= alpha: continue
+    if not maximize and standPat - gain >= beta: continue
+
+    state += move
+    value = quiesce(state, evaluator, generator, not maximize,
+                    alpha, beta, depth+1, limits)
+    state -= move
+
+    if maximize:
+      best = max(value, best)
+      alpha = max(alpha, best)
+    else:
+      best = min(value, best)
+      beta = min(beta, best)
+
+  return best
+
+def count_non_pawn_pieces(state, color):
+  """Knights, bishops, rooks and queens of a color"""
+  pieces = state.colors[color] & ~state.pieceTypes[0] & ~state.pieceTypes[5]
+  return bin(pieces).count('1')
+
+def get_late_move_reduction(moveIndex, remainingDepth):
+  """Plies to reduce a late move by. Grows with the move index and the
+  remaining depth, and always leaves the reduced move at least one ply."""
+  reduction = int(log(remainingDepth) * log(moveIndex+1) / 2) or 1
+  return min(reduction, remainingDepth-2)
+
+def search_null_move(state, evaluator, generator, maximize, alpha, beta,
+                     depth, maxDepth, maxValue, table, limits):
+  """Null Move Pruning
+
+  The side to move passes. If the reduced search of the resulting position
+  still fails high, a real move would almost certainly do so too, so the
+  node can be cut off. Positions where passing would be an advantage
+  (zugzwang) are likely when the side to move has few pieces, so there the
+  cutoff is verified with a reduced search of the node itself. Returns the
+  cutoff value or None.
+  """
+  reducedDepth = maxDepth - NULL_MOVE_REDUCTION
+  window = (beta-NULL_WINDOW, beta) if maximize else (alpha, alpha+NULL_WINDOW)
+  failsHigh = (lambda v: v >= beta) if maximize else (lambda v: v <= alpha)
+
+  state += None
+  value = explore_leaves(state, evaluator, generator, not maximize, *window,
+                         depth+1, reducedDepth, maxValue, table, limits)
+  state -= None
+  if not failsHigh(value): return None
+
+  pieces = count_non_pawn_pieces(state, state.colorToMove)
+  if pieces <= NULL_MOVE_VERIFICATION_PIECES:
+    value = explore_leaves(state, evaluator, generator, maximize, *window,
+                           depth, reducedDepth, maxValue, table, limits,
+                           allowNullMove=False)
+    if not failsHigh(value): return None
+
+  return value
+
+def explore_leaves(state, evaluator, generator, maximize, alpha, beta,
+                   depth, maxDepth, maxValue, table=None, limits=None,
+                   allowNullMove=True):
   """Minimax Alpha-Beta Search
 
   This recursive function preforms a depth first tree search. The nodes
@@ -24,97 +186,264 @@ def explore_leaves(state, evaluator, generator, maximize,
 
   The root state node is never copied, but rather, it is updated and passed
   on to searches of the children nodes. When the max search depth is reached,
-  the leaves are evaluated and compared, and then the moves are reverted as
-  the recursive calls collapse.
+  the leaves are resolved with a quiescence search, and then the moves are
+  reverted as the recursive calls collapse.
+
+  Principal variation search: the first move is searched with the full
+  window, and the rest with a null window, which only proves that they are
+  not better. A move that turns out to be better is searched again with the
+  full window. Moves that raise the score inside the window are recorded in
+  the generator's principle variation table.
+
+  Selective search (each can be switched off in settings.py): null move
+  pruning, late move reductions, futility pruning of quiet moves one ply
+  from the leaves, and reverse futility pruning of nodes whose static
+  evaluation beats beta by a margin.
+
+  If a transposition table is given, it is probed before move generation
+  and the result of the node is stored once its moves have been searched.
+
+  Search limits are checked at every node. When they run out, a
+  SearchTimeout is raised and the moves made so far are left on the state
+  for the caller to revert.
   """
-
-  attacks,attackSets = generator.find_attacks(state)
+  generator.clear_principle_variation(depth)
 
   # recursive base case. Leaf has been reached. Return its valuation.
-  if depth >= maxDepth and isQuiet:
-    return evaluator(state, attacks)
-
-  monitor.node_searched(depth)
-
-  # only search captures if depth surpassed max depth. If the max depth
-  # is surpassed and it's quiet, search all moves, but use stop search
-  # parameter to make it the last search on this branch
-  if depth < maxDepth:
-    moves = generator.find_moves(state, attacks, attackSets)
-  elif depth == maxDepth:
-    moves = generator.find_captures(state,attacks,attackSets)
-  else:
-    moves = generator.find_strong_captures(state, attacks, attackSets,
-                                           findTrades = depth == maxDepth+1)
-
+  if depth >= maxDepth:
+    return quiesce(state, evaluator, generator, maximize,
+                   alpha, beta, depth, limits)
+
+  if stats is not None: stats.node_searched()
+  if limits is not None: limits.node_searched()
+
+  # probe the transposition table. A deep enough entry can end the search
+  # of this node (unless it's the root, which has to return a move), and
+  # its best move is searched first either way.
+  hashMove = None
+  useTable = table is not None
+  if useTable:
+    entry = table.probe(state.hash)
+    if entry is not None:
+      hashMove = entry.move
+      if depth > 0 and entry.depth >= maxDepth - depth:
+        if entry.bound == EXACT: return entry.score
+        if entry.bound == LOWER and entry.score >= beta: return entry.score
+        if entry.bound == UPPER and entry.score <= alpha: return entry.score
+
+  # the previous iteration's principle variation is searched first, or the
+  # transposition table's best move when this node is off the variation
+  pvMove = generator.find_principle_variation_move(state, depth) or hashMove
 
-  if len(moves) == 0:
-    assert depth >= maxDepth
-
-    return evaluator(state, attacks)
-
-  # sorting moves everytime seems to speed things up
-  moveOrder = []
-  while len(moves) > 0:
-    m = moves.pop()
-    state+=m
-    v = evaluator(state,attacks, mode=0)
-    moveOrder.append((v,m))
-    state-=m
-  moves = sorted(moveOrder, key=lambda x:x[0], reverse=state.colorToMove==1)
-  moves = [m[1] for m in moves]
+  attacks,attackSets = generator.find_attacks(state)
 
-  # beam search
-  if depth == maxDepth-1: moves = moves[-10:]
-  # if depth >= maxDepth: moves = moves[-5:]
+  color = state.colorToMove
+  king = state.pieceTypes[5] & state.colors[color]
+  inCheck = king & attackSets[not color] != 0
+  remainingDepth = maxDepth - depth
+  futile = False
+
+  if depth > 0 and not inCheck:
+    staticEvaluation = evaluator(state, attacks)
+    pawnValue = evaluator.capture_value(0)
+
+    # reverse futility pruning
+    if settings.REVERSE_FUTILITY_PRUNING \
+        and remainingDepth <= REVERSE_FUTILITY_DEPTH:
+      margin = FUTILITY_MARGIN * pawnValue * remainingDepth
+      if maximize and staticEvaluation - margin >= beta \
+          or not maximize and staticEvaluation + margin <= alpha:
+        return staticEvaluation
+
+    # null move pruning, unless the last move was a null move
+    if settings.NULL_MOVE_PRUNING and allowNullMove \
+        and remainingDepth > NULL_MOVE_REDUCTION \
+        and state.history[-1] is not None \
+        and count_non_pawn_pieces(state, color) > 0 \
+        and (staticEvaluation >= beta if maximize
+             else staticEvaluation <= alpha):
+      value = search_null_move(state, evaluator, generator, maximize,
+                               alpha, beta, depth, maxDepth, maxValue,
+                               table, limits)
+      if value is not None: return value
+
+    # futility pruning: quiet moves can't bring the score back to the window
+    if settings.FUTILITY_PRUNING and remainingDepth == 1:
+      margin = FUTILITY_MARGIN * pawnValue
+      futile = maximize and staticEvaluation + margin <= alpha \
+            or not maximize and staticEvaluation - margin >= beta
+
+  moves = generator.pick_moves(state, attacks, attackSets, pvMove, depth)
+  killers = generator.killers[depth]
+  moveIndex = -1
 
   # initilize best as worst value
   best = -maxValue if maximize else maxValue
+  alphaOrig,betaOrig = alpha,beta
   bestMove = None
 
-  # search edges until alpha/beta cutoff occurs
-  while beta > alpha and len(moves) > 0:
+  # search edges until alpha/beta cutoff occurs. Moves are generated in
+  # stages as they are needed, highest priority first.
+  for move in moves:
+    moveIndex += 1
 
-    # get the highest priority move from the move queue
-    move = moves.pop()
+    isQuiet = not chess.moves.is_capture(move) and move != pvMove \
+          and move not in killers
+    if futile and isQuiet and bestMove is not None: continue
 
     # get child node by updating state
     state += move
 
+    # make recursive call to perform depth first search. After the first
+    # move, try to prove the move is worse with a null window first.
+    args = (state, evaluator, generator, not maximize)
+    kwargs = dict(table = table, limits = limits)
+    searchFullWindow = bestMove is None
+    if not searchFullWindow:
+      nullWindow = (alpha, alpha+NULL_WINDOW) if maximize \
+              else (beta-NULL_WINDOW, beta)
+
+      # late move reductions: search late quiet moves shallower first,
+      # and again at full depth if they turn out better
+      reduction = 0
+      if settings.LATE_MOVE_REDUCTIONS and isQuiet and not inCheck \
+          and remainingDepth >= LATE_MOVE_MIN_DEPTH \
+          and moveIndex >= LATE_MOVE_MIN_INDEX:
+        reduction = get_late_move_reduction(moveIndex, remainingDepth)
+        value = explore_leaves(*args, *nullWindow, depth+1,
+                               maxDepth-reduction, maxValue, **kwargs)
+
+      if not reduction or (value > alpha if maximize else value < beta):
+        value = explore_leaves(*args, *nullWindow, depth+1, maxDepth,
+                               maxValue, **kwargs)
+      searchFullWindow = alpha < value < beta
+    if searchFullWindow:
+      value = explore_leaves(*args, alpha, beta, depth+1, maxDepth,
+                             maxValue, **kwargs)
 
-    # make recursive call to perform depth first search
-    value = explore_leaves(state, evaluator, generator,
-                           not maximize, alpha, beta,
-                           depth+1, maxDepth, maxValue,
-                           isQuiet = move.captureType is None)
     # revert state
     state -= move
 
     # maximize white and minimize black
     if maximize:
-      best = max(value, best)
+      if value > best: best,bestMove = value,move
+      if value > alpha: generator.set_a_principle_variation(depth, move)
       alpha = max(alpha, best)
-      bestMove = move
     else:
-      best = min(value, best)
+      if value < best: best,bestMove = value,move
+      if value < beta: generator.set_a_principle_variation(depth, move)
       beta = min(beta,best)
-      bestMove = move
 
-  if beta<=alpha: monitor.cutoff(maximize)
+    if beta <= alpha: break
+
+  # no legal moves: checkmate, which is worse the sooner it happens, or
+  # stalemate. The root has no best move.
+  if moveIndex < 0:
+    if not inCheck: best = 0
+    else: best = -(maxValue-depth) if maximize else maxValue-depth
+    return (best,None) if depth == 0 else best
+
+  if beta<=alpha:
+    if stats is not None: stats.cutoff(moveIndex)
+    generator.update_move_ordering(state, bestMove, depth, maxDepth - depth)
+
+  # store the result, which is only exact if it landed inside the window
+  if useTable and bestMove is not None:
+    if best <= alphaOrig:  bound = UPPER
+    elif best >= betaOrig: bound = LOWER
+    else:                  bound = EXACT
+    table.store(state.hash, maxDepth - depth, best, bound, bestMove)
 
   # if depth is 0, the search is complete
   return (best,bestMove) if depth == 0 else best
 
-def make_best_move(state, evaluator, generator):
-  alpha,beta = -MAX_VALUE,MAX_VALUE
+def iterative_deepening(state, evaluator, generator, table=None,
+                        limits=None, maxDepth=settings.SEARCH_DEPTH,
+                        startDepth=1):
+  """Iterative Deepening
+
+  Searches to depth 1, 2, 3... (or from the given start depth) until the max
+  depth is reached or the search limits run out, following the previous
+  iteration's principle variation.
+  Returns the evaluation, best move, and depth of the deepest finished
+  iteration. The first iteration is always finished so there is a move,
+  unless the root has no legal moves (checkmate or stalemate), in which
+  case the move is None and the search stops after the first iteration.
+
+  After the first iteration, the search starts with an aspiration window
+  around the previous evaluation. If the evaluation falls outside of it,
+  the window is widened and the iteration is searched again.
+  """
   maximizeRoot = not state.colorToMove # maximize white
-  depth,maxDepth = 0,settings.SEARCH_DEPTH
-
-  leafEvaluation, bestMove = explore_leaves(state, evaluator, generator,
-                                            maximizeRoot, alpha, beta,
-                                            depth, maxDepth, MAX_VALUE)
-  print('leaf eval: ' + str(leafEvaluation))
+  historyLength = len(state.history)
+  generator.new_search()
+
+  result = None
+  for depth in range(startDepth, maxDepth+1):
+    if result is not None and limits is not None \
+        and not limits.allows_next_iteration():
+      break
+
+    window = ASPIRATION_WINDOW
+    if stats is not None: stats.start_iteration()
+    try:
+      while True:
+        if result is None or window >= MAX_VALUE:
+          alpha,beta = -MAX_VALUE,MAX_VALUE
+        else:
+          alpha,beta = result[0]-window, result[0]+window
+
+        leafEvaluation, bestMove = explore_leaves(
+          state, evaluator, generator, maximizeRoot, alpha, beta, 0, depth,
+          MAX_VALUE, table=table, limits=None if result is None else limits)
+
+        if alpha < leafEvaluation < beta: break
+        window *= 4
+    except SearchTimeout:
+      # revert the moves of the unfinished iteration
+      while len(state.history) > historyLength:
+        state -= state.history[-1]
+      if stats is not None: stats.finish_iteration(depth, finished=False)
+      break
+
+    if stats is not None: stats.finish_iteration(depth)
+    result = leafEvaluation, bestMove, depth
+    if bestMove is None: break
+    generator.follow_principle_variation(generator.get_principle_variation())
+
+  return result
+
+def make_best_move(state, evaluator, generator, table=None, limits=None,
+                   pool=None):
+  """Searches the state and applies the best move. Returns the move, or
+  None if the game is over (the side to move has no legal moves)
+
+  With a search pool (see chess/parallel.py), the search is run by the
+  pool's worker processes instead of this one. Otherwise, if search stats
+  are switched on, they are dumped as JSON after the move is found.
+  """
+  if pool is not None:
+    leafEvaluation, bestMove, depth, line = pool.search(state)
+  else:
+    if limits is None:
+      limits = SearchLimits(settings.SEARCH_TIME, settings.SEARCH_NODES)
+    if table is not None: table.new_search()
+    if stats is not None: stats.new_search(evaluator, table)
+
+    leafEvaluation, bestMove, depth = iterative_deepening(state, evaluator,
+                                                          generator, table,
+                                                          limits)
+    line = generator.previousPrincipleVariation # deepest finished iteration
+    if stats is not None: stats.dump(settings.SEARCH_STATS_FILE)
+
+  if bestMove is None:
+    print('checkmate' if leafEvaluation else 'stalemate')
+    return None
+
+  print(f'leaf eval: {leafEvaluation} (depth {depth})')
+  print('principle variation:', ' '.join(map(chess.moves.get_move_notation, line)))
   state += bestMove
+  return bestMove
 
 def play_computer_game():
   import time
@@ -123,6 +452,15 @@ def play_computer_game():
   state = chess.board.create_initial_position()
   generator = chess.moves.Generator()
   evaluator = chess.board.Evaluator()
+  pool = None
+  if settings.SEARCH_PROCESSES > 1:
+    from chess.parallel import SearchPool
+    pool = SearchPool(settings.SEARCH_PROCESSES)
+    table = pool.table
+  elif settings.SHARED_HASH_NAME is not None:
+    table = open_shared_table(settings.SHARED_HASH_NAME)
+  else:
+    table = TranspositionTable()
 
   print(state)
 
@@ -130,7 +468,8 @@ def play_computer_game():
   while movesMade < MAX_MOVES:
     movesMade += 1
     start = time.time()
-    make_best_move(state, evaluator, generator)
+    if make_best_move(state, evaluator, generator, table, pool=pool) is None:
+      break
     end = time.time()
     print('found move in ' + str(end - start) + ' seconds')
 
@@ -139,10 +478,12 @@ def play_computer_game():
     for label,score,w in zip(['material','pst','center control', 'development', 'tempo', 'connectivity'],scores,evaluator.weights):
       print('\t',label,': ', score(state, attacks)*w)
 
-    monitor.print_results()
-    # monitor.reset()
+    print('transposition table:', table.stats())
     valuation = evaluator(state, generator.find_attacks(state)[0])
     print('valuation: ' + str(valuation))
     print(state)
 
+  if pool is not None: pool.close()
+  elif settings.SHARED_HASH_NAME is not None: table.close()
+
 def play_against_computer(): pass
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Search Statistics"""
+
+import json
+from time import time
+
+class SearchStats:
+  """Per Move Search Instrumentation
+
+  Counts search nodes, quiescence nodes and beta cutoffs, and records the
+  nodes and time spent on each iterative deepening iteration. The hooks
+  only increment counters. Everything else (nodes per second, effective
+  branching factor, cutoff and hit rates) is derived in report().
+
+  The search calls the hooks through the module level stats object in
+  chess/search.py, which is None when settings.SEARCH_STATS is off, so a
+  disabled search doesn't pay for them.
+  """
+
+  def __init__(self):
+    self.new_search()
+
+  def new_search(self, evaluator=None, table=None):
+    """Resets the counters. The evaluator's eval cache and the
+    transposition table counters are reported relative to this point."""
+    self.nodes = self.quiescenceNodes = 0
+    self.cutoffs = self.firstMoveCutoffs = 0
+    self.iterations = []
+    self.start = time()
+    self.evaluator, self.table = evaluator, table
+    self.evaluatorCounts = SearchStats.get_cache_counts(evaluator)
+    self.tableCounts = SearchStats.get_table_counts(table)
+
+  def node_searched(self):
+    self.nodes += 1
+
+  def quiescence_node_searched(self):
+    self.quiescenceNodes += 1
+
+  def cutoff(self, moveIndex):
+    self.cutoffs += 1
+    if moveIndex == 0: self.firstMoveCutoffs += 1
+
+  def start_iteration(self):
+    self.iterationStart = (time(), self.nodes, self.quiescenceNodes)
+
+  def finish_iteration(self, depth, finished=True):
+    """Records the iteration. Unfinished iterations ran out of budget."""
+    start, nodes, quiescenceNodes = self.iterationStart
+    self.iterations.append({
+      'depth': depth,
+      'finished': finished,
+      'nodes': self.nodes - nodes,
+      'quiescence nodes': self.quiescenceNodes - quiescenceNodes,
+      'time': time() - start,
+    })
+
+  @staticmethod
+  def get_cache_counts(evaluator):
+    if evaluator is None: return (0,0)
+    return evaluator.cacheProbes, evaluator.cacheHits
+
+  @staticmethod
+  def get_table_counts(table):
+    if table is None: return (0,0)
+    return table.probes, table.hits
+
+  def report(self):
+    """Statistics of the search since new_search() as a dict"""
+    rate = lambda count,total: count/total if total else 0
+    elapsed = time() - self.start
+    totalNodes = self.nodes + self.quiescenceNodes
+
+    # the branching factor of an iteration is its node count relative to
+    # the previous one. The effective branching factor is the average
+    # branching factor of the deepest finished iteration's tree.
+    iterations, previousNodes, effectiveBranchingFactor = [], None, 0
+    for iteration in self.iterations:
+      nodes = iteration['nodes'] + iteration['quiescence nodes']
+      branchingFactor = rate(nodes, previousNodes)
+      iterations.append({**iteration, 'branching factor': branchingFactor})
+      if iteration['finished']:
+        effectiveBranchingFactor = nodes ** (1 / iteration['depth'])
+      previousNodes = nodes
+
+    evaluatorProbes, evaluatorHits = [
+      now - then for now,then in zip(SearchStats.get_cache_counts(self.evaluator),
+                                     self.evaluatorCounts)]
+    tableProbes, tableHits = [
+      now - then for now,then in zip(SearchStats.get_table_counts(self.table),
+                                     self.tableCounts)]
+
+    return {
+      'nodes': self.nodes,
+      'quiescence nodes': self.quiescenceNodes,
+      'time': elapsed,
+      'nodes per second': rate(totalNodes, elapsed),
+      'effective branching factor': effectiveBranchingFactor,
+      'cutoffs': self.cutoffs,
+      'first move cutoff rate': rate(self.firstMoveCutoffs, self.cutoffs),
+      'eval cache hit rate': rate(evaluatorHits, evaluatorProbes),
+      'transposition table hit rate': rate(tableHits, tableProbes),
+      'iterations': iterations,
+    }
+
+  def to_json(self):
+    return json.dumps(self.report())
+
+  def dump(self, path=None):
+    """Prints the report as JSON, or appends it to a file as a JSON line"""
+    if path is None:
+      print('search stats:', self.to_json())
+    else:
+      with open(path, 'a') as f:
+        f.write(self.to_json() + '\n')
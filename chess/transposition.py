@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Transposition Table"""
+
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+
+import settings
+from chess.moves import MOVE_MASK
+
+BOUNDS = [EXACT, LOWER, UPPER] = range(3)
+
+Entry = namedtuple('Entry', ('key', 'depth', 'score', 'bound', 'move', 'age'))
+
+class TranspositionTable:
+  """Fixed Size Search Cache Keyed on Zobrist Hashes
+
+  The table is a flat list of buckets. Each bucket has two slots: a
+  depth-preferred slot, which only gets replaced by an entry searched at
+  least as deep (or by any entry once it is left over from an earlier
+  search), and an always-replace slot which takes everything else. The
+  number of buckets is derived from a memory budget in megabytes.
+  """
+
+  # approximate bytes used by one stored entry: the list slot, the entry
+  # tuple and its key/score/move ints
+  ENTRY_SIZE = 160
+
+  def __init__(self, size=settings.HASH_SIZE):
+    self.numBuckets = max(1, (size << 20) // (2*TranspositionTable.ENTRY_SIZE))
+    self.entries = [None] * (2*self.numBuckets)
+    self.age = 0
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.probes = self.hits = self.collisions = 0
+    self.stores = self.overwrites = 0
+
+  def clear(self):
+    """Empties every slot"""
+    self.entries = [None] * (2*self.numBuckets)
+    self.age = 0
+    self.reset_stats()
+
+  def new_search(self):
+    """Marks existing entries as stale so deep slots can be reclaimed"""
+    self.age += 1
+
+  def probe(self, key):
+    """Returns the entry stored for the key or None"""
+    self.probes += 1
+    index = (key % self.numBuckets) << 1
+    deep,recent = self.entries[index], self.entries[index+1]
+
+    if deep is not None and deep.key == key:
+      self.hits += 1
+      return deep
+    if recent is not None and recent.key == key:
+      self.hits += 1
+      return recent
+
+    # the bucket is occupied by other positions
+    if deep is not None or recent is not None:
+      self.collisions += 1
+    return None
+
+  def store(self, key, depth, score, bound, move):
+    """Stores a search result using the depth-preferred/always-replace scheme"""
+    self.stores += 1
+    index = (key % self.numBuckets) << 1
+    deep = self.entries[index]
+
+    replaceDeep = deep is None or deep.key == key \
+               or deep.age != self.age or depth >= deep.depth
+
+    if not replaceDeep: index += 1
+    replaced = self.entries[index]
+    if replaced is not None and replaced.key != key:
+      self.overwrites += 1
+
+    self.entries[index] = Entry(key, depth, score, bound, move, self.age)
+
+  def stats(self):
+    """Hit, collision and overwrite counts and rates"""
+    rate = lambda count,total: count/total if total else 0
+    return {
+      'probes': self.probes,
+      'hits': self.hits,
+      'collisions': self.collisions,
+      'stores': self.stores,
+      'overwrites': self.overwrites,
+      'hit rate': rate(self.hits, self.probes),
+      'collision rate': rate(self.collisions, self.probes),
+      'overwrite rate': rate(self.overwrites, self.stores),
+    }
+
+class SharedTranspositionTable:
+  """Transposition Table in Shared Memory
+
+  Same interface and bucket scheme as TranspositionTable, but stored in a
+  multiprocessing.shared_memory block so that several processes can share
+  search results. Other processes attach to the table by its name.
+
+  The block starts with a header (number of buckets and search age),
+  followed by entries of three 64 bit words: the key, the packed data
+  (score, move, depth, bound and age) and a check word equal to key XOR
+  data. There are no locks. Instead, a reader compares the check word,
+  and an entry whose words were written by different stores (a race) is
+  treated as a miss. Hit/race counters are kept per process.
+  """
+
+  HEADER_WORDS = 2
+  ENTRY_WORDS = 3
+  ENTRY_SIZE = ENTRY_WORDS * 8
+
+  # score is stored as a 32 bit float
+  floatToBits = struct.Struct('<f')
+  bitsToFloat = struct.Struct('<I')
+
+  def __init__(self, size=settings.HASH_SIZE, name=None, create=True):
+    if create:
+      numBuckets = max(1, (size << 20) // (2*SharedTranspositionTable.ENTRY_SIZE))
+      numWords = SharedTranspositionTable.HEADER_WORDS \
+               + 2*numBuckets*SharedTranspositionTable.ENTRY_WORDS
+      self.memory = shared_memory.SharedMemory(name, True, numWords*8)
+      self.words = self.memory.buf[:numWords*8].cast('Q')
+      self.words[0] = numBuckets
+    else:
+      self.memory = shared_memory.SharedMemory(name)
+      numBuckets = self.memory.buf[:8].cast('Q')[0]
+      numWords = SharedTranspositionTable.HEADER_WORDS \
+               + 2*numBuckets*SharedTranspositionTable.ENTRY_WORDS
+      self.words = self.memory.buf[:numWords*8].cast('Q')
+
+    self.name = self.memory.name
+    self.isOwner = create
+    self.numBuckets = numBuckets
+    self.size = numWords*8 # bytes
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.probes = self.hits = self.collisions = self.races = 0
+    self.stores = self.overwrites = 0
+
+  def clear(self):
+    """Empties every slot"""
+    for index in range(SharedTranspositionTable.HEADER_WORDS, len(self.words)):
+      self.words[index] = 0
+    self.words[1] = 0
+    self.reset_stats()
+
+  def new_search(self):
+    """Marks existing entries as stale so deep slots can be reclaimed"""
+    self.words[1] = (self.words[1] + 1) & 7
+
+  def close(self):
+    """Detaches from the table. The creator also frees the memory."""
+    self.words.release()
+    self.memory.close()
+    if self.isOwner: self.memory.unlink()
+
+  def pack(self, depth, score, bound, move):
+    scoreBits = self.bitsToFloat.unpack(self.floatToBits.pack(score))[0]
+    return scoreBits | move << 32 | depth << 51 \
+         | bound << 59 | self.words[1] << 61
+
+  def unpack(self, key, data):
+    score = self.floatToBits.unpack(self.bitsToFloat.pack(data & 0xFFFFFFFF))[0]
+    return Entry(key, data >> 51 & 255, score, data >> 59 & 3,
+                 data >> 32 & MOVE_MASK, data >> 61)
+
+  def get_slot(self, key):
+    bucket = key % self.numBuckets
+    return SharedTranspositionTable.HEADER_WORDS \
+         + bucket * 2*SharedTranspositionTable.ENTRY_WORDS
+
+  def probe(self, key):
+    """Returns the entry stored for the key or None"""
+    self.probes += 1
+    words = self.words
+    slot = self.get_slot(key)
+    occupied = False
+
+    for index in (slot, slot+SharedTranspositionTable.ENTRY_WORDS):
+      storedKey,data,check = words[index], words[index+1], words[index+2]
+      if storedKey == key:
+        if key ^ data != check: # written concurrently
+          self.races += 1
+          return None
+        self.hits += 1
+        return self.unpack(key, data)
+      occupied = occupied or storedKey != 0
+
+    if occupied: self.collisions += 1
+    return None
+
+  def store(self, key, depth, score, bound, move):
+    """Stores a search result using the depth-preferred/always-replace scheme"""
+    self.stores += 1
+    words = self.words
+    index = self.get_slot(key)
+
+    deepKey,deepData = words[index], words[index+1]
+    replaceDeep = deepKey == 0 or deepKey == key \
+               or deepData >> 61 != words[1] or depth >= deepData >> 51 & 255
+
+    if not replaceDeep: index += SharedTranspositionTable.ENTRY_WORDS
+    if words[index] != 0 and words[index] != key:
+      self.overwrites += 1
+
+    data = self.pack(depth, score, bound, move)
+    words[index] = key
+    words[index+1] = data
+    words[index+2] = key ^ data
+
+  def stats(self):
+    """Hit, collision, overwrite and race counts and rates, and fill rate"""
+    rate = lambda count,total: count/total if total else 0
+    firstKey = SharedTranspositionTable.HEADER_WORDS
+    keys = self.words[firstKey::SharedTranspositionTable.ENTRY_WORDS]
+    filled = sum(1 for key in keys if key != 0)
+    return {
+      'probes': self.probes,
+      'hits': self.hits,
+      'collisions': self.collisions,
+      'races': self.races,
+      'stores': self.stores,
+      'overwrites': self.overwrites,
+      'hit rate': rate(self.hits, self.probes),
+      'collision rate': rate(self.collisions, self.probes),
+      'overwrite rate': rate(self.overwrites, self.stores),
+      'fill rate': filled / (2*self.numBuckets),
+    }
+
+def open_shared_table(name, size=settings.HASH_SIZE):
+  """Attaches to the named shared table, creating it if it doesn't exist
+
+  For use by independent engine processes. Child processes of the creator
+  (like search pool workers) share its resource tracker and can attach
+  with the constructor directly.
+  """
+  try:
+    table = SharedTranspositionTable(name=name, create=False)
+  except FileNotFoundError:
+    return SharedTranspositionTable(size, name)
+
+  # this process's resource tracker would free the block when the process
+  # exits. Only the creator should do that.
+  resource_tracker.unregister(table.memory._name, 'shared_memory')
+  return table
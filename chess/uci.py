@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Universal Chess Interface (UCI)"""
+
+import sys
+import threading
+
+import settings
+import chess.moves
+import chess.board
+from chess import search
+from chess.transposition import TranspositionTable
+
+ENGINE_NAME = 'pychessengine'
+ENGINE_AUTHOR = 'perintyler'
+
+START_POSITION = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Hash option range in megabytes
+HASH_SIZE_RANGE = (1, 1024)
+
+# Clock management: without movestogo, the remaining time is spread over
+# this many moves. Part of the increment is kept as a safety margin.
+MOVES_TO_GO = 30
+INCREMENT_USAGE = 0.8
+
+# deepest iteration of an infinite (or ponder) search
+INFINITE_DEPTH = chess.moves.MAX_PLY - 1
+
+GO_PARAMETERS = ('depth', 'movetime', 'wtime', 'btime', 'winc', 'binc',
+                 'movestogo', 'nodes')
+
+def get_move_time(timeLeft, increment=0, movesToGo=None):
+  """Seconds to spend on a move, given the clock in milliseconds"""
+  budget = timeLeft / (movesToGo or MOVES_TO_GO) + increment * INCREMENT_USAGE
+  return min(budget, timeLeft / 2) / 1000
+
+def respond(*args):
+  print(*args, flush=True)
+
+class UCIEngine:
+  """UCI Command Handler
+
+  Keeps the position, move generator, evaluator and transposition table
+  between commands. Searches run in a background thread, so the command
+  loop can keep reading commands while the engine thinks. A search is
+  stopped with its search limits, which end it at the next searched node.
+
+  Infinite and ponder searches never report their best move on their own.
+  They wait for stop (or ponderhit, after which a ponder search continues
+  as a normal timed search).
+  """
+
+  def __init__(self, output=respond):
+    self.output = output
+    self.generator = chess.moves.Generator()
+    self.evaluator = chess.board.Evaluator()
+    self.table = TranspositionTable()
+    self.state = chess.board.create_position(START_POSITION)
+
+    self.thread = None
+    self.limits = None
+    self.ponderTime = None
+    self.infinite = False
+    self.released = threading.Event() # set when the best move can be sent
+
+  def handle(self, line):
+    """Handles one command. Returns False once the engine should quit"""
+    tokens = line.split()
+    if not tokens: return True
+    command, args = tokens[0], tokens[1:]
+
+    if command == 'uci':
+      self.output('id name', ENGINE_NAME)
+      self.output('id author', ENGINE_AUTHOR)
+      self.output('option name Hash type spin default %d min %d max %d'
+                  % (settings.HASH_SIZE, *HASH_SIZE_RANGE))
+      self.output('option name Ponder type check default false')
+      self.output('uciok')
+    elif command == 'isready':
+      self.output('readyok')
+    elif command == 'setoption':
+      self.stop()
+      self.set_option(args)
+    elif command == 'ucinewgame':
+      self.stop()
+      self.generator = chess.moves.Generator()
+      self.table.clear()
+    elif command == 'position':
+      self.stop()
+      self.set_position(args)
+    elif command == 'go':
+      self.stop()
+      self.go(args)
+    elif command == 'stop':
+      self.stop()
+    elif command == 'ponderhit':
+      self.ponderhit()
+    elif command == 'quit':
+      self.stop()
+      return False
+    return True
+
+  def set_option(self, args):
+    if 'name' not in args or 'value' not in args: return
+    name = ' '.join(args[args.index('name')+1:args.index('value')])
+    value = ' '.join(args[args.index('value')+1:])
+    if name.lower() == 'hash':
+      size = min(max(int(value), HASH_SIZE_RANGE[0]), HASH_SIZE_RANGE[1])
+      self.table = TranspositionTable(size)
+
+  def set_position(self, args):
+    """position [startpos | fen <fen>] [moves <move1> ... <movei>]"""
+    movesIndex = args.index('moves') if 'moves' in args else len(args)
+    if args and args[0] == 'fen':
+      fen = ' '.join(args[1:movesIndex])
+    else:
+      fen = START_POSITION
+    try:
+      state = chess.board.create_position(fen)
+      for notation in args[movesIndex+1:]:
+        state += chess.moves.parse_move_notation(state, notation)
+    except (chess.board.InvalidFenException,
+            chess.board.InvalidPieceOperation,
+            chess.moves.InvalidMoveException) as error:
+      self.output('info string', error)
+      return
+    self.state = state
+
+  def go(self, args):
+    """go [depth|movetime|wtime|btime|winc|binc|movestogo|nodes <x>]
+          [infinite] [ponder]"""
+    options = {}
+    for index,token in enumerate(args[:-1]):
+      if token in GO_PARAMETERS: options[token] = int(args[index+1])
+
+    white = not self.state.colorToMove
+    clock = options.get('wtime' if white else 'btime')
+    if 'movetime' in options:
+      maxTime = options['movetime'] / 1000
+    elif clock is not None:
+      increment = options.get('winc' if white else 'binc', 0)
+      maxTime = get_move_time(clock, increment, options.get('movestogo'))
+    else:
+      maxTime = None
+
+    self.infinite = 'infinite' in args
+    infinite = self.infinite or 'ponder' in args
+    if 'depth' in options:
+      maxDepth = min(max(options['depth'], 1), INFINITE_DEPTH)
+    elif infinite or maxTime is not None or 'nodes' in options:
+      maxDepth = INFINITE_DEPTH
+    else:
+      maxDepth = settings.SEARCH_DEPTH
+
+    # a ponder search starts its clock on ponderhit
+    self.ponderTime = maxTime if 'ponder' in args else None
+    if 'ponder' in args: maxTime = None
+
+    self.limits = search.SearchLimits(maxTime, options.get('nodes'))
+    if infinite: self.released.clear()
+    else:        self.released.set()
+
+    self.thread = threading.Thread(target=self.search,
+                                   args=(self.limits, maxDepth), daemon=True)
+    self.thread.start()
+
+  def search(self, limits, maxDepth):
+    """Runs in the search thread. Reports the result and the best move"""
+    state, generator = self.state, self.generator
+    attacks,attackSets = generator.find_attacks(state)
+    if len(generator.find_moves(state, attacks, attackSets)) == 0:
+      self.released.wait()
+      self.output('bestmove 0000')
+      return
+
+    self.table.new_search()
+    if search.stats is not None:
+      search.stats.new_search(self.evaluator, self.table)
+
+    evaluation, move, depth = search.iterative_deepening(
+      state, self.evaluator, generator, self.table, limits, maxDepth)
+    line = generator.previousPrincipleVariation
+
+    # scores are reported in centipawns from the side to move's view
+    pawns = evaluation / self.evaluator.capture_value(0)
+    score = round(100 * (-pawns if state.colorToMove else pawns))
+    milliseconds = int(1000 * limits.elapsed())
+    self.output('info depth %d score cp %d nodes %d time %d nps %d pv %s' % (
+      depth, score, limits.nodes, milliseconds,
+      1000 * limits.nodes // max(milliseconds, 1),
+      ' '.join(map(chess.moves.get_move_notation, line))))
+
+    self.released.wait()
+    bestMove = 'bestmove ' + chess.moves.get_move_notation(move)
+    if len(line) > 1 and line[0] == move:
+      bestMove += ' ponder ' + chess.moves.get_move_notation(line[1])
+    self.output(bestMove)
+
+  def stop(self):
+    """Stops the search, and waits for it to report its best move"""
+    if self.thread is None: return
+    self.limits.stop()
+    self.released.set()
+    self.thread.join()
+    self.thread = None
+
+  def ponderhit(self):
+    """The expected move was played. Keeps searching as a normal search"""
+    if self.thread is None: return
+    if self.ponderTime is not None: self.limits.set_time(self.ponderTime)
+    if not self.infinite: self.released.set()
+
+  def wait(self):
+    """Waits for a search that ends on its own (not infinite)"""
+    if self.thread is not None: self.thread.join()
+
+def run():
+  """Reads commands from standard input until quit"""
+  engine = UCIEngine()
+  for line in sys.stdin:
+    if not engine.handle(line): break
+  engine.stop()
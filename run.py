@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """Engine Entry Point"""
 
+import sys
+
 import settings
 import chess
 from tests import run_all_tests
@@ -9,6 +11,24 @@ from tests import run_all_tests
 def start():
   chess.pregame.setup()
 
+  # python run.py uci: talk to a GUI or match manager over stdin/stdout
+  if sys.argv[1:] == ['uci']:
+    chess.uci.run()
+    return
+
+  # python run.py magics [options]: search denser magic tables (see
+  # chess/pregame/finder.py)
+  if sys.argv[1:2] == ['magics']:
+    from chess.pregame import finder
+    finder.run(sys.argv[2:])
+    chess.pregame.setup()
+    return
+
+  # python run.py perft [depth]: move generation reference suite
+  if sys.argv[1:2] == ['perft']:
+    chess.perft.run_reference_suite(*map(int, sys.argv[2:3]))
+    return
+
   if settings.DEBUG:
     run_all_tests()
 
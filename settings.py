@@ -7,17 +7,49 @@ DEBUG = True
 # If False, the engine plays against a user
 COMPUTER_PLAY = True
 
-# How many moves ahead the engine searches
+# How many moves ahead the engine searches. Iterative deepening stops
+# at this depth unless the per move time or node budget runs out first.
 SEARCH_DEPTH = 5
 
+# Per move search budget in seconds and in nodes (None for no limit)
+SEARCH_TIME = 5
+SEARCH_NODES = None
+
+# Number of processes searching each move (Lazy SMP). With 1, the search
+# runs in the main process.
+SEARCH_PROCESSES = 1
+
+# Selective search. Each technique can be switched off on its own to
+# compare nodes searched to reach a depth.
+NULL_MOVE_PRUNING = True
+LATE_MOVE_REDUCTIONS = True
+FUTILITY_PRUNING = True
+REVERSE_FUTILITY_PRUNING = True
+
+# Search statistics (nodes, branching factor, cutoff and hit rates, time
+# per iteration), dumped as JSON after each move. Printed, or appended to
+# SEARCH_STATS_FILE as one line per move if it is set. Switching them off
+# removes the per node bookkeeping.
+SEARCH_STATS = True
+SEARCH_STATS_FILE = None
+
+# Transposition table memory budget in megabytes
+HASH_SIZE = 16
+
+# Name of a transposition table in shared memory. If set, the engine
+# attaches to it (creating it if needed) so that engines running in other
+# processes can share search results.
+SHARED_HASH_NAME = None
+
 # Data files created during pregame setup.
 DATA_DIRECTORY = 'data'
 
 # used for pregame setup to create initial piece
 # bitboards in pregame/generate/board.py. To
 # try a new position, change this board str
-# array and delete board.json. Rerunning the
-# engine will then regenerate data/board.json
+# array. Rerunning the engine will then
+# regenerate data/board.pickle, since the data
+# file no longer matches its inputs
 INITIAL_POSITION = [
     'r', 'n', 'b', 'q', 'k', 'b', 'n', 'r',
     'p', 'p', 'p', 'p', 'p', 'p', 'p', 'p',
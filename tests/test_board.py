@@ -34,6 +34,10 @@ def test_piece_set():
       assert piece not in pieces
       pieces.add(piece)
 
+      # the mailbox finds the piece by square
+      assert state.get_piece_type(piece) == pieceType
+    assert sum(index is not None for index in state.pieces.mailbox) == len(pieces)
+
   for _ in range(30):
     check_for_doubles()
     state += get_random_move(state)
@@ -60,5 +64,144 @@ def test_zobrist_hashing():
 
   print('state zobrist hashing test passed')
 
+def test_hash_components():
+  state = board.create_position(
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+
+  def check_hashes():
+    # incrementally updated hashes must equal hashes computed from scratch
+    recomputed = board.State(state.colorToMove, state.pieces[:],
+                             state.castlingRights, state.enPassantFile)
+    assert state.hash == recomputed.hash
+    assert state.pawnHash == recomputed.pawnHash
+    assert state.materialHash == recomputed.materialHash
+
+  for _ in range(30):
+    check_hashes()
+    moves = get_all_moves(state)
+    if not moves: break
+    for move in moves:
+      state += move
+      check_hashes()
+      state -= move
+    state += get_random_move(state)
+
+  # castling rights and en passant files are part of the hash only
+  fen = 'r3k2r/8/8/8/3pP3/8/8/R3K2R b KQkq e3 0 1'
+  state = board.create_position(fen)
+  assert (state.castlingRights, state.enPassantFile) == (15, 4)
+  for other in ('r3k2r/8/8/8/3pP3/8/8/R3K2R b KQk e3 0 1',
+                'r3k2r/8/8/8/3pP3/8/8/R3K2R b KQkq - 0 1'):
+    otherState = board.create_position(other)
+    assert otherState.hash != state.hash
+    assert otherState.pawnHash == state.pawnHash
+    assert otherState.materialHash == state.materialHash
+
+  # moving the rook loses its right, even once it moves back
+  from chess.moves import parse_move_notation
+  for notation in ('a8b8', 'a1b1', 'b8a8', 'b1a1'):
+    state += parse_move_notation(state, notation)
+  assert state.castlingRights == 5 and state.enPassantFile is None
+  while state.history:
+    state -= state.history[-1]
+  assert state.hash == board.create_position(fen).hash
+  print('hash component test passed')
+
+def test_null_move():
+  state = board.create_initial_position()
+  hashBeforeMove = state.hash
+  state += None
+  assert state.colorToMove == 1 and state.hash != hashBeforeMove
+  state -= None
+  assert state.colorToMove == 0 and state.hash == hashBeforeMove
+  print('null move test passed')
+
+def test_attack_maps():
+  state = board.create_position(
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+
+  def check_attack_maps():
+    # incrementally updated maps must equal maps computed from scratch
+    recomputed = board.State(state.colorToMove, state.pieces[:])
+    assert state.attacks == recomputed.attacks
+    assert state.attackSets == recomputed.attackSets
+
+  for _ in range(30):
+    check_attack_maps()
+    moves = get_all_moves(state)
+    if not moves: break
+    for move in moves:
+      state += move
+      check_attack_maps()
+      state -= move
+    state += get_random_move(state)
+  while state.history:
+    state -= state.history[-1]
+    check_attack_maps()
+  print('incremental attack map test passed')
+
+def test_square_indexing():
+  import chess.pregame
+  bitboard = board.SQUARE_BITBOARDS[3] | board.SQUARE_BITBOARDS[40]
+  assert board.get_square(bitboard) == 3
+  assert board.get_last_square(bitboard) == 40
+  assert list(board.get_squares(bitboard)) == [40, 3]
+
+  # square indexed tables hold the same values as the bitboard keyed ones
+  moves,movesets = chess.pregame.load_move_cache()
+  squareMoves,squareMovesets = chess.pregame.load_move_cache(bySquare=True)
+  masks = chess.pregame.load_move_masks()
+  squareMasks = chess.pregame.load_move_masks(bySquare=True)
+  for square,piece in enumerate(board.SQUARE_BITBOARDS):
+    assert squareMoves[1][square] == moves[1][piece]
+    assert squareMovesets[0][1][square] == movesets[0][1][piece]
+    assert squareMasks.pawnBlockers[0][square] == masks.pawnBlockers[0][piece]
+    assert squareMasks.between[square][63] == masks.between[piece][1]
+  print('square indexing test passed')
+
+def test_binary_tables():
+  import chess.pregame
+  # the memory-mapped tables hold the same values as the pickled ones
+  assert chess.pregame.load_binary_tables() is not None
+  bishopMagic = chess.pregame.load_magic()[0]
+  pickledMagic = chess.pregame.load_data_file(chess.pregame.DATA_FILES.magic)
+  assert list(bishopMagic.attacks) == pickledMagic['bishop'][0]
+  assert list(bishopMagic.magics) == pickledMagic['bishop'][3]
+
+  movesets = chess.pregame.load_move_sets()
+  pickledMovesets = chess.pregame.load_move_cache(bySquare=True)[1]
+  assert list(movesets[0][1][12]) == list(pickledMovesets[0][1][12])
+  assert list(movesets[3]) == pickledMovesets[3]
+
+  hashTable = board.create_initial_position().hashTable
+  pickledBoard = chess.pregame.load_data_file(chess.pregame.DATA_FILES.board)
+  assert list(hashTable) == pickledBoard['hash values']
+  print('binary table test passed')
+
+def test_data_file_invalidation():
+  import settings
+  from chess.pregame import save
+  assert save.data_is_generated()
+
+  # a data file is out of date once its inputs change
+  initialPosition = settings.INITIAL_POSITION
+  settings.INITIAL_POSITION = initialPosition[::-1]
+  try:
+    assert not save.data_file_is_current(save.DATA_FILES.board)
+    assert not save.data_file_is_current(save.DATA_FILES.tables)
+    assert save.data_file_is_current(save.DATA_FILES.magic)
+  finally:
+    settings.INITIAL_POSITION = initialPosition
+  print('data file invalidation test passed')
+
 def test_update():
   pass
+
+def test_pregame_registry():
+  import chess.moves
+  # positions and generators share the tables loaded by the first one
+  first, second = board.create_initial_position(), board.create_initial_position()
+  assert first.hashTable is second.hashTable
+  assert first.pieces.typeLookup is second.pieces.typeLookup
+  assert chess.moves.Generator().masks is chess.moves.Generator().masks
+  print('pregame registry test passed')
@@ -1,14 +1,175 @@
 # -*- coding: utf-8 -*-
 """Move generation and ordering tests"""
 
+from chess import board, moves
+
 def test_attack_generation():
   pass
 
 def test_magic_cache():
-  pass
+  import random
+  from chess.pregame.magic import subtract_blockers, create_ray_mask
+  from chess.pregame.magic import N, NE, E, SE, S, SW, W, NW
+  generator = moves.Generator()
+
+  # magic lookups agree with calculating the blocked rays
+  for square in range(64):
+    piece = moves.SQUARE_BITBOARDS[square]
+    for _ in range(20):
+      occupied = random.getrandbits(64) & random.getrandbits(64)
+      for pieceType,rays in ((2, ((NE,SW),(SE,NW))), (3, ((E,W),(N,S)))):
+        expected = 0
+        for directions in rays:
+          rayMask = create_ray_mask(square, *directions)
+          expected |= subtract_blockers(piece, occupied, rayMask)
+        assert generator.search_magic_cache(square, pieceType, occupied) == expected
+  print('magic cache test passed')
+
+def test_magic_finder():
+  from chess.pregame import finder
+
+  # the configured magics are valid and their table has no unused entries
+  config = finder.load_magic_config()['bishop']
+  assert finder.validate_magics('bishop', config['magics'], config['shifts'],
+                                config['offsets']) == 5248
+
+  # magics found with a fixed shift in a shared table, whose parts overlap
+  found = finder.find_magics('bishop', fixedShift=55, shared=True, tries=1000)
+  assert set(found['shifts']) == {55}
+  size = finder.validate_magics('bishop', found['magics'], found['shifts'],
+                                found['offsets'])
+  assert size < 64 * 2**9
+  print('magic finder test passed')
 
 def test_legal_move_generation():
-  pass
+  from chess import perft
+  generator = moves.Generator()
+
+  # reference positions whose first plies have no castling, en passant or
+  # promotions
+  for index,depth in ((0,3), (2,2), (5,2), (6,3)):
+    name,fen,expectedNodes = perft.REFERENCE_POSITIONS[index]
+    state = board.create_position(fen)
+    assert perft.perft(state, depth, generator) == expectedNodes[depth-1], name
+
+  # the bishop checks the king. The pinned knight can't block it, the king
+  # can't step back along the diagonal, and the queen can capture it.
+  state = board.create_position('3r2k1/8/8/3N4/1b5Q/8/3K4/8 w - - 0 1')
+  legalMoves = perft.generate_moves(state, generator)[0]
+  assert sorted(map(moves.get_move_notation, legalMoves)) == \
+         ['d2c1', 'd2c2', 'd2d1', 'd2d3', 'd2e2', 'd2e3', 'h4b4']
+
+  # a killer from another position has to be legal here too
+  attacks,attackSets = generator.find_attacks(state)
+  pinnedMove = moves.parse_move_notation(state, 'd5c3')
+  assert not generator.is_valid_move(state, pinnedMove, attackSets)
+  print('legal move generation test passed')
+
+def test_pawn_moves():
+  from chess import perft
+  generator = moves.Generator()
+
+  # the a2 pawn is blocked from a double push, and the h4 pawn can't
+  # capture across the board edge onto a4
+  state = board.create_position('7k/8/8/8/p6P/1p6/P7/K7 w - - 0 1')
+  pawnMoves = [move for move in perft.generate_moves(state, generator)[0]
+               if moves.get_piece_type(move) == 0]
+  assert sorted(map(moves.get_move_notation, pawnMoves)) == \
+         ['a2a3', 'a2b3', 'h4h5']
+
+  state = board.create_position('7k/8/8/8/p6P/1p6/P7/K7 b - - 0 1')
+  pawnMoves = [move for move in perft.generate_moves(state, generator)[0]
+               if moves.get_piece_type(move) == 0]
+  assert sorted(map(moves.get_move_notation, pawnMoves)) == \
+         ['a4a3', 'b3a2', 'b3b2']
+  print('pawn move test passed')
+
+def test_static_exchange_evaluation():
+  generator = moves.Generator()
+
+  # the rook wins an undefended pawn
+  state = board.create_position('1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1')
+  move = moves.parse_move_notation(state, 'e1e5')
+  assert generator.evaluate_exchange(state, move) == 1
+
+  # the queens behind the rook and the bishop join the exchange (x-rays),
+  # and the knight is lost for a pawn
+  state = board.create_position(
+    '1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1')
+  move = moves.parse_move_notation(state, 'd3e5')
+  assert generator.evaluate_exchange(state, move) == -2
+
+  # the losing capture is ordered after the other moves
+  attacks,attackSets = generator.find_attacks(state)
+  picked = list(generator.pick_moves(state, attacks, attackSets))
+  assert picked[-1] == move
+  print('static exchange evaluation test passed')
 
 def test_ordering():
-  pass
+  state = board.create_initial_position()
+  generator = moves.Generator()
+  attacks,attackSets = generator.find_attacks(state)
+
+  def find_first_moves(n=None):
+    ordering = generator.find_moves(state, attacks, attackSets, ply=1)
+    return [ordering.pop() for _ in range(n or len(ordering))]
+
+  # a move that caused a cutoff is searched first at its ply
+  lastMove = find_first_moves()[-1]
+  generator.update_move_ordering(state, lastMove, 1, 4)
+  assert find_first_moves(1)[0] == lastMove
+
+  # a second killer goes in front of the first one
+  otherMove = find_first_moves()[-1]
+  generator.update_move_ordering(state, otherMove, 1, 3)
+  assert find_first_moves(2) == [otherMove, lastMove]
+
+  # without the killers, history scores keep the ranking
+  generator.killers[1] = [None, None]
+  assert find_first_moves(2) == [lastMove, otherMove]
+  print('move ordering test passed')
+
+def test_perft():
+  from chess import perft
+  state = board.create_position(perft.REFERENCE_POSITIONS[1].fen)
+  hashBeforePerft = state.hash
+  generator = moves.Generator()
+  attacks,attackSets = generator.find_attacks(state)
+
+  # bulk counting, counting made leaves and divide agree
+  nodes = perft.perft(state, 2, generator)
+  assert perft.perft(state, 0) == 1
+  assert perft.perft(state, 1, generator) == \
+         len(generator.find_moves(state, attacks, attackSets))
+  assert perft.perft_counts(state, 2, generator).nodes == nodes
+  assert sum(perft.divide(state, 2, generator).values()) == nodes
+  assert state.hash == hashBeforePerft and not state.history
+
+  counts = perft.perft_counts(state, 1, generator)
+  assert counts.captures == len(generator.find_captures(state, attacks, attackSets))
+  print('perft test passed')
+
+def test_staged_move_picking():
+  state = board.create_position(
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+  generator = moves.Generator()
+  attacks,attackSets = generator.find_attacks(state)
+  ordering = generator.find_moves(state, attacks, attackSets)
+  allMoves = [ordering.pop() for _ in range(len(ordering))]
+
+  # the same moves in the same order as a complete move list
+  quietMove = next(move for move in allMoves if not moves.is_capture(move))
+  generator.killers[2] = [quietMove, None]
+  pvMove = allMoves[-1]
+  ordering = generator.find_moves(state, attacks, attackSets, pvMove=pvMove, ply=2)
+  expected = [ordering.pop() for _ in range(len(ordering))]
+  picked = list(generator.pick_moves(state, attacks, attackSets, pvMove, 2))
+  assert picked == expected and picked[0] == pvMove
+
+  # killers and hash moves from other positions are only picked if legal
+  illegalMove = moves.create_move(moves.SQUARE_BITBOARDS[0],
+                                  moves.SQUARE_BITBOARDS[8], 3, 0)
+  generator.killers[2] = [illegalMove, None]
+  picked = list(generator.pick_moves(state, attacks, attackSets, illegalMove, 2))
+  assert sorted(picked) == sorted(allMoves)
+  print('staged move picking test passed')
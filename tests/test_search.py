@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Game tree search tests"""
+
+from chess import board, moves, search
+from chess.transposition import TranspositionTable
+
+def test_iterative_deepening_budget():
+  state = board.create_initial_position()
+  hashBeforeSearch = state.hash
+  generator, evaluator = moves.Generator(), board.Evaluator()
+
+  limits = search.SearchLimits(maxNodes=50)
+  evaluation,move,depth = search.iterative_deepening(
+    state, evaluator, generator, TranspositionTable(size=1), limits, 10)
+
+  # the unfinished iteration is reverted and a finished one is returned
+  assert move is not None and 1 <= depth < 10
+  assert state.hash == hashBeforeSearch and not state.history
+  print('iterative deepening budget test passed')
+
+def test_principle_variation():
+  state = board.create_initial_position()
+  generator, evaluator = moves.Generator(), board.Evaluator()
+
+  evaluation,move,depth = search.iterative_deepening(
+    state, evaluator, generator, TranspositionTable(size=1), maxDepth=3)
+
+  # the followed line starts with the best move and can be played out
+  line = generator.previousPrincipleVariation
+  assert line and line[0] == move
+  for lineMove in line: state += lineMove
+  for lineMove in reversed(line): state -= lineMove
+  print('principle variation test passed')
+
+def test_checkmate():
+  # back rank mate in one
+  state = board.create_position('6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1')
+  evaluation,move,depth = search.iterative_deepening(
+    state, board.Evaluator(), moves.Generator(), TranspositionTable(size=1),
+    maxDepth=3)
+  assert moves.get_move_notation(move) == 'a1a8'
+  assert evaluation == search.MAX_VALUE - 1
+  print('checkmate test passed')
+
+def test_game_over_root():
+  from chess.parallel import SearchPool
+  # black is checkmated, which is a win for white, or stalemated
+  for fen,expected in (('R5k1/5ppp/8/8/8/8/5PPP/6K1 b - - 0 1', search.MAX_VALUE),
+                       ('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1', 0)):
+    state = board.create_position(fen)
+    generator, evaluator = moves.Generator(), board.Evaluator()
+    evaluation,move,depth = search.iterative_deepening(
+      state, evaluator, generator, TranspositionTable(size=1), maxDepth=3)
+    assert (evaluation, move, depth) == (expected, None, 1)
+    assert search.make_best_move(state, evaluator, generator) is None
+    assert not state.history
+
+  pool = SearchPool(2)
+  try:
+    evaluation,move,depth,line = pool.search(state, maxTime=None,
+                                             maxNodes=None, maxDepth=3)
+  finally:
+    pool.close()
+  assert move is None and evaluation == 0
+  print('game over root test passed')
+
+def test_selective_search():
+  import settings
+  techniques = ('NULL_MOVE_PRUNING', 'LATE_MOVE_REDUCTIONS',
+                'FUTILITY_PRUNING', 'REVERSE_FUTILITY_PRUNING')
+  defaults = [getattr(settings, name) for name in techniques]
+
+  def count_nodes(enabled):
+    for name in techniques: setattr(settings, name, enabled)
+    state = board.create_initial_position()
+    limits = search.SearchLimits()
+    search.iterative_deepening(state, board.Evaluator(), moves.Generator(),
+                               TranspositionTable(size=1), limits, 4)
+    return limits.nodes
+
+  try:
+    assert count_nodes(True) < count_nodes(False)
+  finally:
+    for name,default in zip(techniques, defaults): setattr(settings, name, default)
+  print('selective search test passed')
+
+def test_parallel_search():
+  from chess.parallel import SearchPool
+  state = board.create_initial_position()
+  pool = SearchPool(2)
+  try:
+    evaluation,move,depth,line = pool.search(state, maxTime=None,
+                                             maxNodes=None, maxDepth=3)
+  finally:
+    pool.close()
+  assert depth == 3 and line[0] == move and not state.history
+  print('parallel search test passed')
+
+def test_search_stats():
+  import json
+  from chess.stats import SearchStats
+  state = board.create_initial_position()
+  generator, evaluator = moves.Generator(), board.Evaluator()
+  table = TranspositionTable(size=1)
+
+  stats = SearchStats()
+  stats.new_search(evaluator, table)
+  defaultStats, search.stats = search.stats, stats
+  try:
+    search.iterative_deepening(state, evaluator, generator, table, maxDepth=3)
+  finally:
+    search.stats = defaultStats
+
+  report = json.loads(stats.to_json())
+  assert [iteration['depth'] for iteration in report['iterations']] == [1,2,3]
+  assert sum(i['nodes'] for i in report['iterations']) == report['nodes'] > 0
+  assert report['quiescence nodes'] > 0 and report['effective branching factor'] > 1
+  assert 0 < report['first move cutoff rate'] <= 1
+  assert 0 < report['transposition table hit rate'] < 1
+  assert 0 < report['eval cache hit rate'] < 1
+  print('search stats test passed')
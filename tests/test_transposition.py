@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Transposition Table Tests"""
+
+from chess.moves import create_move
+from chess.transposition import TranspositionTable, SharedTranspositionTable
+from chess.transposition import EXACT, LOWER, UPPER
+
+def test_probe_and_store():
+  table = TranspositionTable(size=1)
+  assert table.probe(1234) is None
+
+  table.store(1234, 3, 0.5, EXACT, 'move')
+  entry = table.probe(1234)
+  assert (entry.depth, entry.score, entry.bound, entry.move) == \
+         (3, 0.5, EXACT, 'move')
+
+  stats = table.stats()
+  assert stats['probes'] == 2 and stats['hits'] == 1
+  print('transposition table probe/store test passed')
+
+def test_replacement_scheme():
+  table = TranspositionTable(size=1)
+  key = 7
+  sameBucket = key + table.numBuckets
+
+  # a shallower entry goes to the always-replace slot
+  table.store(key, 4, 1, LOWER, 'deep')
+  table.store(sameBucket, 2, 2, UPPER, 'shallow')
+  assert table.probe(key).move == 'deep'
+  assert table.probe(sameBucket).move == 'shallow'
+
+  # a third position overwrites the always-replace slot
+  table.store(sameBucket + table.numBuckets, 1, 3, EXACT, 'newest')
+  assert table.probe(sameBucket) is None
+  assert table.probe(key).move == 'deep'
+  assert table.stats()['overwrites'] == 1
+  assert table.stats()['collisions'] == 1
+
+  # stale deep entries are replaced once a new search starts
+  table.new_search()
+  table.store(sameBucket, 1, 4, EXACT, 'fresh')
+  assert table.probe(key) is None
+  assert table.probe(sameBucket).move == 'fresh'
+  print('transposition table replacement test passed')
+
+def test_shared_table():
+  table = SharedTranspositionTable(size=1)
+  attached = SharedTranspositionTable(name=table.name, create=False)
+  try:
+    move = create_move(1 << 52, 1 << 36, 0, 0)
+    table.store(1234, 3, 0.5, LOWER, move)
+
+    # results stored by one handle are visible to the other
+    entry = attached.probe(1234)
+    assert (entry.depth, entry.score, entry.bound, entry.move) == \
+           (3, 0.5, LOWER, move)
+
+    # an entry whose check word doesn't match is a race, not a hit
+    slot = attached.get_slot(1234)
+    attached.words[slot+1] ^= 1
+    assert attached.probe(1234) is None
+    assert attached.stats()['races'] == 1
+    assert 0 < table.stats()['fill rate'] < 1
+  finally:
+    attached.close()
+    table.close()
+  print('shared transposition table test passed')
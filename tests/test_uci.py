@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""UCI Tests"""
+
+import time
+
+from chess import board
+from chess.uci import UCIEngine, START_POSITION
+
+def test_position():
+  engine = UCIEngine(output=lambda *args: None)
+  engine.handle('position startpos moves g1f3 g8f6')
+
+  state = board.create_position(START_POSITION)
+  initial = board.create_initial_position()
+  assert state.hash == initial.hash
+
+  fen = 'rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2'
+  assert engine.state.hash == board.create_position(fen).hash
+  assert str(engine.state) == str(board.create_position(fen))
+  print('uci position test passed')
+
+def test_go_and_stop():
+  output = []
+  engine = UCIEngine(output=lambda *args: output.append(' '.join(map(str, args))))
+  engine.handle('position startpos')
+  engine.handle('go depth 2')
+  engine.wait()
+  assert output[-1].startswith('bestmove')
+
+  # an infinite search only reports its move once it is stopped
+  engine.handle('go infinite')
+  time.sleep(0.2)
+  assert not output[-1].startswith('info')
+  start = time.time()
+  engine.handle('stop')
+  assert time.time() - start < 0.5 and output[-1].startswith('bestmove')
+  assert not engine.state.history
+  print('uci go/stop test passed')
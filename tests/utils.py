@@ -1,11 +1,20 @@
 import chess
 import random
 
+# shared by the helpers. Moves are generated without a ply, so the killer
+# and history tables it would keep between searches stay empty.
+generator = None
+
+def get_generator():
+    global generator
+    if generator is None: generator = chess.moves.Generator()
+    return generator
+
 def state_to_char_array(state):
     return ''.join(str(state).split('\n'))
 
 def get_random_move(state):
-    generator = chess.moves.Generator()
+    generator = get_generator()
     attacks,attackSet = generator.find_attacks(state)
     moves = generator.find_moves(state, attacks,attackSet)
     randomMoveNumber = random.randrange(len(moves))
@@ -13,7 +22,7 @@ def get_random_move(state):
     return moves.pop()
 
 def get_all_moves(state):
-    generator = chess.moves.Generator()
+    generator = get_generator()
     attacks,attackSet = generator.find_attacks(state)
     moves = generator.find_moves(state, attacks,attackSet)
     moveList = []